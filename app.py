@@ -1,5 +1,5 @@
 import gradio as gr
-from inference import load_fine_tuned_model, grok_inference
+from inference import load_fine_tuned_model, grok_classify, grok_context, build_grok_messages, grok_stream
 from dotenv import load_dotenv
 from retriver import last_update_api, update_api
 import os
@@ -13,10 +13,18 @@ password = os.getenv('GRADIO_PASSWORD')
 # Load model and tokenizer
 # model, tokenizer = load_fine_tuned_model(model_id)
 
-# Define inference function
-def gradio_inference(user_input, tweet):
-    response, classification, context = grok_inference(user_input, tweet)
-    return str(response), str(classification), str(context)
+# Define inference function: each panel fills in as soon as its stage finishes, then the reply streams
+async def gradio_inference(user_input, tweet):
+    classification = await grok_classify(user_input)
+    yield "", str(classification), ""
+
+    context = await grok_context(user_input, tweet, classification)
+    yield "", str(classification), str(context)
+
+    response = ""
+    async for text in grok_stream(build_grok_messages(user_input, tweet, context)):
+        response += text
+        yield response, str(classification), str(context)
 
 # Define database update function
 def update_database():
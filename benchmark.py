@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+import torch
+
+
+def sync_device():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def load_questions(path, limit=None):
+    questions = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                questions.append(json.loads(line)["question"])
+    return questions[:limit] if limit else questions
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{label:<16} mean={statistics.mean(timings) * 1000:8.2f}ms  p50={statistics.median(timings) * 1000:8.2f}ms  p95={p95 * 1000:8.2f}ms")
+    return statistics.mean(timings)
+
+# ----------------------> CLASSIFIER PREFIX CACHE <---------------------- #
+def classifier_prefill_benchmark(path, limit=None):
+    from classifier import model, tokenizer, classifier_prefix, build_classifier_messages
+
+    if classifier_prefix is None:
+        raise RuntimeError("Classifier prefix cache is not available for this model/tokenizer.")
+
+    questions = [q for q in load_questions(path, limit) if q.strip()]
+    full_timings = []
+    cached_timings = []
+
+    # Warm up kernels so the first query doesn't skew either side
+    with torch.no_grad():
+        model(input_ids=classifier_prefix.input_ids, use_cache=True)
+
+    for question in questions:
+        text = tokenizer.apply_chat_template(build_classifier_messages(question), tokenize=False, add_generation_prompt=True)
+        model_inputs = classifier_prefix.build_inputs(text)
+        if model_inputs is None:
+            continue
+        input_ids = model_inputs["input_ids"]
+
+        with torch.no_grad():
+            sync_device()
+            start = time.perf_counter()
+            model(input_ids=input_ids, use_cache=True)
+            sync_device()
+            full_timings.append(time.perf_counter() - start)
+
+            # The copy is part of the per-request cost, so it is timed too
+            sync_device()
+            start = time.perf_counter()
+            model(
+                input_ids=input_ids[:, classifier_prefix.length:],
+                past_key_values=classifier_prefix.cache(),
+                use_cache=True
+            )
+            sync_device()
+            cached_timings.append(time.perf_counter() - start)
+
+    if not full_timings:
+        raise RuntimeError(f"No usable questions in {path}")
+
+    print(f"Prefill over {len(full_timings)} queries (prefix: {classifier_prefix.length} tokens)")
+    full_mean = summarize("full prefill", full_timings)
+    cached_mean = summarize("cached prefix", cached_timings)
+    print(f"speedup          {full_mean / cached_mean:.2f}x")
+
+# ----------------------> PERSONA MICRO-BATCHING <---------------------- #
+def persona_burst_benchmark(path, model_id, burst=8, batch_sizes=(1, 2, 4, 8)):
+    # Fires a burst of concurrent persona generations at engines with different batch limits
+    from concurrent.futures import ThreadPoolExecutor
+    from engine import GenerationEngine
+    from inference import load_fine_tuned_model, PERSONA_SYSTEM_PROMPT, PERSONA_SAMPLING
+
+    model, tokenizer = load_fine_tuned_model(model_id)
+    questions = [q for q in load_questions(path) if q.strip()][:burst]
+    if len(questions) < burst:
+        raise RuntimeError(f"Need {burst} questions in {path}, found {len(questions)}")
+    conversations = [
+        [{"role": "system", "content": PERSONA_SYSTEM_PROMPT}, {"role": "user", "content": question}]
+        for question in questions
+    ]
+
+    for size in batch_sizes:
+        engine = GenerationEngine(model, tokenizer, system_prompts=[PERSONA_SYSTEM_PROMPT], max_batch_size=size)
+        # Warm-up so kernel selection doesn't land on the first measured burst
+        engine.generate(conversations[0], **PERSONA_SAMPLING)
+
+        with ThreadPoolExecutor(max_workers=burst) as pool:
+            sync_device()
+            start = time.perf_counter()
+            list(pool.map(lambda messages: engine.generate(messages, **PERSONA_SAMPLING), conversations))
+            sync_device()
+            elapsed = time.perf_counter() - start
+
+        stats = engine.get_batch_stats()
+        print(f"max_batch_size={size:<3} {burst / elapsed:6.2f} req/s  avg_batch={stats['avg_batch_size']:.2f}  avg_wait={stats['avg_wait_ms']:.1f}ms")
+        # Stop the batcher without releasing the shared model
+        engine.queue.put(None)
+        engine.batch_worker.join()
+
+# ----------------------> RAG DB STATS <---------------------- #
+def rag_db_stats_benchmark(rounds=20):
+    # Runs against whatever RAG_DB_* points to, e.g. a local Postgres loaded with a copy of the tables
+    import psycopg2
+    from rag_db import RAG_DB_PARAMS, close_rag_db_pool
+    from retriver import get_rag_db_stats, exact_count_cache
+
+    timings = {"fresh connect": [], "pooled estimate": [], "exact (cold)": [], "exact (cached)": []}
+    for _ in range(rounds):
+        start = time.perf_counter()
+        psycopg2.connect(**RAG_DB_PARAMS).close()
+        timings["fresh connect"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        estimated = get_rag_db_stats()
+        timings["pooled estimate"].append(time.perf_counter() - start)
+
+        exact_count_cache.clear()
+        start = time.perf_counter()
+        exact = get_rag_db_stats(exact=True)
+        timings["exact (cold)"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        get_rag_db_stats(exact=True)
+        timings["exact (cached)"].append(time.perf_counter() - start)
+
+    close_rag_db_pool()
+    for label, values in timings.items():
+        summarize(label, values)
+    print(f"estimated: {estimated}")
+    print(f"exact:     {exact}")
+
+# ----------------------> EVENT LOOP RESPONSIVENESS <---------------------- #
+# Generates a reply without posting it; pass --method POST --job /reply-to-recent only on a test account
+DEFAULT_HEALTH_JOB = "/bot-response?query=What%20moved%20the%20crypto%20market%20today%3F"
+
+def health_latency_benchmark(base_url, job_path=DEFAULT_HEALTH_JOB, method="GET", interval=0.05, max_latency_ms=50.0):
+    # Polls /health while a slow job runs on a live server; fails if the event loop stalls
+    import requests
+
+    job_result = {}
+
+    def run_job():
+        start = time.perf_counter()
+        response = requests.request(method, base_url + job_path, timeout=None)
+        job_result["status"] = response.status_code
+        job_result["seconds"] = time.perf_counter() - start
+
+    job = threading.Thread(target=run_job, daemon=True)
+    job.start()
+
+    session = requests.Session()
+    timings = []
+    while job.is_alive():
+        start = time.perf_counter()
+        session.get(base_url + "/health", timeout=10).raise_for_status()
+        timings.append(time.perf_counter() - start)
+        time.sleep(interval)
+    job.join()
+
+    if not timings:
+        raise RuntimeError(f"{job_path} finished before /health could be polled")
+
+    print(f"{job_path} returned {job_result.get('status')} after {job_result.get('seconds', 0):.1f}s; {len(timings)} health checks")
+    summarize("/health", timings)
+    worst = max(timings) * 1000
+    print(f"max              {worst:8.2f}ms")
+    if worst > max_latency_ms:
+        raise SystemExit(f"/health took {worst:.1f}ms while {job_path} was running (limit {max_latency_ms:.0f}ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MIND of Pepe latency benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    prefix_parser = subparsers.add_parser("classifier-prefix", help="Classifier prefill time with and without the cached system prompt")
+    prefix_parser.add_argument("--data", default="Notebooks/data/test.json")
+    prefix_parser.add_argument("--limit", type=int, default=None)
+
+    burst_parser = subparsers.add_parser("persona-burst", help="Persona generation throughput under a burst, per max batch size")
+    burst_parser.add_argument("--data", default="Notebooks/data/test.json")
+    burst_parser.add_argument("--model-id", default=os.getenv("MODEL_ID"))
+    burst_parser.add_argument("--burst", type=int, default=8)
+
+    db_parser = subparsers.add_parser("rag-db-stats", help="Estimated vs exact RAG DB stats and pooled vs fresh connections")
+    db_parser.add_argument("--rounds", type=int, default=20)
+
+    health_parser = subparsers.add_parser("health", help="/health latency while a generation job runs against a live server")
+    health_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    health_parser.add_argument("--job", default=DEFAULT_HEALTH_JOB)
+    health_parser.add_argument("--method", default="GET")
+    health_parser.add_argument("--max-latency-ms", type=float, default=50.0)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "classifier-prefix":
+        classifier_prefill_benchmark(args.data, args.limit)
+    elif args.benchmark == "persona-burst":
+        persona_burst_benchmark(args.data, args.model_id, args.burst)
+    elif args.benchmark == "rag-db-stats":
+        rag_db_stats_benchmark(args.rounds)
+    elif args.benchmark == "health":
+        health_latency_benchmark(args.url, args.job, args.method, max_latency_ms=args.max_latency_ms)
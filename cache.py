@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+MISSING = object()
+
+# ----------------------> VERSIONED CACHE <---------------------- #
+class VersionedCache:
+    # Entries stay valid until the data version they were stored under changes, not on a fixed clock
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def sync_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        with self.lock:
+            self.sync_version(version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value, version):
+        with self.lock:
+            self.sync_version(version)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "version": self.version}
+
+# ----------------------> TTL CACHE <---------------------- #
+class TTLCache:
+    # LRU-bounded cache whose entries expire ttl seconds after they were stored
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+# ----------------------> REQUEST DEDUP <---------------------- #
+class SingleFlight:
+    # Concurrent calls for the same key share one in-flight computation instead of each running it
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.merged = 0
+
+    def do(self, key, fn, timeout=None):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+            else:
+                self.merged += 1
+
+        # Followers stop waiting after timeout seconds (concurrent.futures.TimeoutError); the leader keeps running
+        if not leader:
+            return future.result(timeout=timeout)
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
@@ -1,13 +1,19 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
 import os
 import json
+import re
+import threading
 import torch
 from retriver import tavily_for_post
+from prefix_cache import build_prompt_prefix
+from tokenizer_lock import locked_tokenizer
 from dotenv import load_dotenv
 
 load_dotenv()
 
 classifier_model_id = os.getenv('CLASSIFIER_MODEL')
+# The JSON object is ~40 tokens; generation also stops early at its closing brace
+classifier_max_new_tokens = int(os.getenv('CLASSIFIER_MAX_NEW_TOKENS', 96))
 
 try:
     model = AutoModelForCausalLM.from_pretrained(
@@ -15,19 +21,55 @@ try:
         torch_dtype="auto",
         device_map="auto",
     )
-    tokenizer = AutoTokenizer.from_pretrained(classifier_model_id)
+    # Several model-executor threads classify at once; the lock keeps them off the tokenizer's shared state
+    tokenizer = locked_tokenizer(AutoTokenizer.from_pretrained(classifier_model_id))
+    # Decoder-only batch generation needs left padding
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
 except Exception as e:
     raise RuntimeError(f"Failed to load classifier model or tokenizer: {e}")
 
-# ----------------------> QUERY CLASSIFIER <---------------------- #
-def classifier_model(user_input):
-    try:
-        if not user_input or not user_input.strip():
-            raise ValueError("Query is empty or contains only whitespace.")
+# ----------------------> RULE-BASED FAST PATH <---------------------- #
+EVM_ADDRESS_PATTERN = re.compile(r'\b0x[a-fA-F0-9]{40}\b')
+SOLANA_MINT_PATTERN = re.compile(r'\b[1-9A-HJ-NP-Za-km-z]{28,40}(?:pump|moon)\b')
+TICKER_PATTERN = re.compile(r'(?<![\w$])\$[A-Za-z][A-Za-z0-9_]{0,14}\b')
 
-        messages = [
-            {"role": "system", "content": 
-            """
+classifier_stats = {"total": 0, "fast_path": 0, "model": 0, "decode_tokens": 0, "parse_failures": 0}
+classifier_stats_lock = threading.Lock()
+
+def count_classification(path):
+    with classifier_stats_lock:
+        classifier_stats["total"] += 1
+        classifier_stats[path] += 1
+
+def count_classifier_decode(decode_tokens=0, parse_failures=0):
+    with classifier_stats_lock:
+        classifier_stats["decode_tokens"] += decode_tokens
+        classifier_stats["parse_failures"] += parse_failures
+
+def get_classifier_stats():
+    with classifier_stats_lock:
+        stats = dict(classifier_stats)
+    stats["fast_path_hit_rate"] = stats["fast_path"] / stats["total"] if stats["total"] else 0.0
+    stats["avg_decode_tokens"] = stats["decode_tokens"] / stats["model"] if stats["model"] else 0.0
+    return stats
+
+def rule_based_classifier(user_input):
+    # Mirrors the contract-address rules of the system prompt; returns None when the rules can't decide
+    addresses = EVM_ADDRESS_PATTERN.findall(user_input) + SOLANA_MINT_PATTERN.findall(user_input)
+    if not addresses:
+        return None
+
+    token_names = TICKER_PATTERN.findall(user_input)
+    return {
+        "category": "token",
+        "token_names": token_names or None,
+        "token_address": addresses[0]
+    }
+
+# ----------------------> CLASSIFIER PROMPT <---------------------- #
+CLASSIFIER_SYSTEM_PROMPT = """
                     You are an AI assistant tasked with classifying user queries into one of the following categories: 'general' or 'token'. 
                     A 'general' query is a question about services, while a 'token' query relates to information about tokens, cryptocurrencies, or contract addresses.
 
@@ -44,38 +86,166 @@ def classifier_model(user_input):
                     - Consider the words with `@` as twitter username and do not consider it as token. 
 
                     Please provide your response in **strict JSON format**:
-                    {{
+                    {
                         "category": "<Category of the query>",
                         "token_names": ["List of token names if mentioned, otherwise null"],
                         "token_address": "<Token address from the query if mentioned, otherwise empty string>"
-                    }}
-            """},
-            {"role": "user", "content": user_input}
-        ]
+                    }
+            """
 
-        text = tokenizer.apply_chat_template(
-            messages,
+def build_classifier_messages(user_input):
+    return [
+        {"role": "system", "content": CLASSIFIER_SYSTEM_PROMPT},
+        {"role": "user", "content": user_input}
+    ]
+
+# The system prompt never changes, so its KV state is computed once at load and reused by single-query calls
+classifier_prefix = build_prompt_prefix(model, tokenizer, CLASSIFIER_SYSTEM_PROMPT)
+
+# ----------------------> JSON DECODING <---------------------- #
+def json_object_end(text):
+    # Index just past the closing brace of the first top-level JSON object, or None if it isn't closed yet
+    depth = 0
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"' and depth > 0:
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+def parse_classification(response):
+    start = response.find("{")
+    end = json_object_end(response)
+    if start == -1 or end is None:
+        raise json.JSONDecodeError("No complete JSON object in model response", response, 0)
+    return json.loads(response[start:end])
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    # Marks a sequence finished as soon as its generated text closes the classification object
+    def __init__(self, prompt_length):
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        responses = tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        finished = [json_object_end(response) is not None for response in responses]
+        return torch.tensor(finished, dtype=torch.bool, device=input_ids.device)
+
+classifier_generate_lock = threading.Lock()
+
+def generate_classifications(queries):
+    texts = [
+        tokenizer.apply_chat_template(
+            build_classifier_messages(user_input),
             tokenize=False,
             add_generation_prompt=True
         )
+        for user_input in queries
+    ]
 
-        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    # Left-padded batches would put padding between the cached prefix and the user turn, so they prefill in full
+    model_inputs = None
+    cache_kwargs = {}
+    if len(texts) == 1 and classifier_prefix is not None:
+        model_inputs = classifier_prefix.build_inputs(texts[0])
+        if model_inputs is not None:
+            cache_kwargs["past_key_values"] = classifier_prefix.cache()
 
-        generated_ids = model.generate(**model_inputs, max_length=1024)
+    if model_inputs is None:
+        model_inputs = tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+    prompt_length = model_inputs["input_ids"].shape[1]
 
-        generated_ids = [output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)]
+    # Several model-executor threads can classify at once; the classifier model runs one generate at a time
+    with classifier_generate_lock:
+        generated_ids = model.generate(
+            **model_inputs,
+            **cache_kwargs,
+            max_new_tokens=classifier_max_new_tokens,
+            stopping_criteria=StoppingCriteriaList([JsonObjectStoppingCriteria(prompt_length)]),
+            pad_token_id=tokenizer.pad_token_id
+        )
 
-        response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    new_tokens = generated_ids[:, prompt_length:]
+    count_classifier_decode(decode_tokens=int((new_tokens != tokenizer.pad_token_id).sum()))
+
+    return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+# ----------------------> QUERY CLASSIFIER <---------------------- #
+def classifier_model(user_input):
+    response = None
+    try:
+        if not user_input or not user_input.strip():
+            raise ValueError("Query is empty or contains only whitespace.")
+
+        classification = rule_based_classifier(user_input)
+        if classification is not None:
+            count_classification("fast_path")
+            return classification
+        count_classification("model")
+
+        response = generate_classifications([user_input])[0]
 
-        classification = json.loads(response)
+        classification = parse_classification(response)
 
         return classification
 
     except json.JSONDecodeError as e:
+        count_classifier_decode(parse_failures=1)
         raise ValueError(f"Model response is not valid JSON: {e}\nRaw response: {response}")
     except Exception as e:
         raise RuntimeError(f"Classification failed: {e}")
-    
+
+# ----------------------> BATCH QUERY CLASSIFIER <---------------------- #
+def classifier_model_batch(queries):
+    # Returns one entry per query, in order; failed entries are {"error": ...} so one bad output doesn't fail the batch
+    results = [None] * len(queries)
+    pending = []
+
+    for index, user_input in enumerate(queries):
+        if not isinstance(user_input, str) or not user_input.strip():
+            results[index] = {"error": "Query is empty or contains only whitespace."}
+            continue
+
+        classification = rule_based_classifier(user_input)
+        if classification is not None:
+            count_classification("fast_path")
+            results[index] = classification
+            continue
+
+        count_classification("model")
+        pending.append(index)
+
+    if not pending:
+        return results
+
+    try:
+        responses = generate_classifications([queries[index] for index in pending])
+    except Exception as e:
+        for index in pending:
+            results[index] = {"error": f"Classification failed: {e}"}
+        return results
+
+    for index, response in zip(pending, responses):
+        try:
+            results[index] = parse_classification(response)
+        except json.JSONDecodeError as e:
+            count_classifier_decode(parse_failures=1)
+            results[index] = {"error": f"Model response is not valid JSON: {e}\nRaw response: {response}"}
+
+    return results
+
 # ----------------------> Post Writer <---------------------- #
 def twitter_post_writer():
     try:
@@ -0,0 +1,186 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1024))
+# Snippets that would be cut below this many tokens are dropped instead of truncated
+min_snippet_tokens = int(os.getenv('CONTEXT_MIN_SNIPPET_TOKENS', 32))
+context_top_k = int(os.getenv('CONTEXT_TOP_K', 6))
+# 1.0 ranks purely by relevance; lower values trade relevance for diversity between picked snippets
+mmr_lambda = float(os.getenv('CONTEXT_MMR_LAMBDA', 0.7))
+
+TERM_PATTERN = re.compile(r"[a-z0-9$]+")
+
+TEXT_FIELDS = ("content", "text", "chunk", "description", "summary")
+# Keys that mark a search hit (Tavily/Google result, RAG chunk) rather than a structured record
+SEARCH_RESULT_FIELDS = {"url", "link", "chunk", "chunk_seq", "embedding_uuid", "distance", "score"}
+DROPPED_FIELDS = {"url", "link", "distance", "score", "embedding", "id", "uuid", "embedding_uuid", "chunk_seq", "raw_content", "images"}
+
+# ----------------------> TOKEN COUNTING <---------------------- #
+class TokenCounter:
+    # Counts with the generating model's tokenizer; without one (remote models) falls back to ~4 chars per token
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+
+    def count(self, text):
+        if self.tokenizer is None:
+            return max(1, len(text) // 4)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text, max_tokens):
+        if self.tokenizer is None:
+            return text[:max_tokens * 4]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+# ----------------------> SNIPPET EXTRACTION <---------------------- #
+def item_text(item):
+    if not isinstance(item, dict):
+        return str(item)
+
+    # A search hit carries its text in one field; structured records such as token data are flattened
+    # whole, since their price and market-cap fields matter as much as any description
+    if SEARCH_RESULT_FIELDS & item.keys():
+        for field in TEXT_FIELDS:
+            if isinstance(item.get(field), str) and item[field].strip():
+                return item[field]
+
+    # Structured or unknown record shape: keep scalar fields, drop URLs, ids and scores
+    return "; ".join(
+        f"{key}: {value}"
+        for key, value in item.items()
+        if key not in DROPPED_FIELDS and isinstance(value, (str, int, float)) and str(value).strip()
+    )
+
+def source_snippets(source, results):
+    # Flattens one source's raw results into [{"source", "url", "text"}]; error payloads contribute nothing
+    # Tavily reports failures as a bare string rather than a list
+    if isinstance(results, str):
+        return []
+    if isinstance(results, dict):
+        if "error" in results:
+            return []
+        results = results.get("data", results)
+    if not isinstance(results, list):
+        # A single record or a plain-text payload is treated as a one-item list
+        results = [results]
+
+    snippets = []
+    for item in results:
+        text = " ".join(item_text(item).split())
+        if not text:
+            continue
+        url = (item.get("url") or item.get("link")) if isinstance(item, dict) else None
+        snippets.append({"source": source, "url": url, "text": text})
+    return snippets
+
+def dedupe_snippets(snippets):
+    seen_urls = set()
+    seen_hashes = set()
+    unique = []
+    for snippet in snippets:
+        digest = hashlib.sha1(snippet["text"].lower().encode("utf-8")).hexdigest()
+        if digest in seen_hashes or (snippet["url"] and snippet["url"] in seen_urls):
+            continue
+        seen_hashes.add(digest)
+        if snippet["url"]:
+            seen_urls.add(snippet["url"])
+        unique.append(snippet)
+    return unique
+
+# ----------------------> RERANKING <---------------------- #
+def text_terms(text):
+    return TERM_PATTERN.findall(text.lower())
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    # Lexical relevance of each tokenized document to the query; cheap enough to run on every reply on CPU
+    if not documents:
+        return []
+
+    average_length = sum(len(document) for document in documents) / len(documents) or 1.0
+    document_frequency = Counter(term for document in documents for term in set(document))
+    query_terms = set(text_terms(query))
+
+    scores = []
+    for document in documents:
+        term_counts = Counter(document)
+        score = 0.0
+        for term in query_terms:
+            if term not in term_counts:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            tf = term_counts[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(document) / average_length))
+        scores.append(score)
+    return scores
+
+def jaccard_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def rerank_snippets(query, snippets, top_k=None, lambda_=None, pinned_sources=()):
+    # BM25 relevance + MMR diversity; the best snippet of each pinned source is always kept.
+    # Ties keep the incoming order, so sources that rank their own results stay in that order.
+    top_k = context_top_k if top_k is None else top_k
+    lambda_ = mmr_lambda if lambda_ is None else lambda_
+
+    documents = [text_terms(snippet["text"]) for snippet in snippets]
+    term_sets = [set(document) for document in documents]
+    scores = bm25_scores(query, documents)
+    best = max(scores, default=0.0) or 1.0
+    relevance = [score / best for score in scores]
+
+    selected = []
+    candidates = list(range(len(snippets)))
+
+    for source in pinned_sources:
+        pinned = [index for index in candidates if snippets[index]["source"] == source]
+        if pinned and len(selected) < top_k:
+            index = max(pinned, key=lambda i: (relevance[i], -i))
+            selected.append(index)
+            candidates.remove(index)
+
+    while candidates and len(selected) < top_k:
+        def mmr_score(index):
+            redundancy = max((jaccard_similarity(term_sets[index], term_sets[chosen]) for chosen in selected), default=0.0)
+            return lambda_ * relevance[index] - (1 - lambda_) * redundancy
+
+        index = max(candidates, key=lambda i: (mmr_score(i), -i))
+        selected.append(index)
+        candidates.remove(index)
+
+    return [snippets[index] for index in selected]
+
+# ----------------------> CONTEXT ASSEMBLY <---------------------- #
+def assemble_context(query, sources, tokenizer=None, budget=None, top_k=None, pinned_sources=("rag",)):
+    # sources is an ordered {name: raw results} mapping; candidates from every source are reranked
+    # against the query and only the top_k are packed, most relevant first
+    budget = context_token_budget if budget is None else budget
+    counter = TokenCounter(tokenizer)
+
+    snippets = []
+    for name, results in sources.items():
+        snippets.extend(source_snippets(name, results))
+    snippets = dedupe_snippets(snippets)
+    snippets = rerank_snippets(query, snippets, top_k=top_k, pinned_sources=pinned_sources)
+
+    report = {name: 0 for name in sources}
+    lines = []
+    remaining = budget
+    for snippet in snippets:
+        text = snippet["text"]
+        tokens = counter.count(text)
+        if tokens > remaining:
+            if remaining < min_snippet_tokens:
+                continue
+            text = counter.truncate(text, remaining)
+            tokens = counter.count(text)
+        lines.append(text)
+        report[snippet["source"]] += tokens
+        remaining -= tokens
+
+    report["total"] = budget - remaining
+    return "\n".join(lines), report
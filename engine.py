@@ -0,0 +1,259 @@
+import gc
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from prefix_cache import PrefixCacheRegistry
+from tokenizer_lock import locked_tokenizer
+
+# Fraction of device memory reserved by the allocator above which cached blocks are handed back
+memory_pressure_threshold = float(os.getenv("CUDA_MEMORY_PRESSURE_THRESHOLD", 0.9))
+
+# Seconds a streaming consumer waits for the next chunk before giving up on a stalled generation
+stream_chunk_timeout = float(os.getenv("STREAM_CHUNK_TIMEOUT", 60))
+
+# How long the first queued request waits for others to join its batch, and the largest batch run at once
+batch_window = float(os.getenv("BATCH_WINDOW_MS", 15)) / 1000
+max_batch_size = int(os.getenv("MAX_BATCH_SIZE", 8))
+
+class CancelledStoppingCriteria(StoppingCriteria):
+    # Ends generation at the next token once the caller has gone away
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+class QueuedGeneration:
+    def __init__(self, messages, sampling):
+        self.messages = messages
+        self.sampling = sampling
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+    def sampling_key(self):
+        # Only requests with identical generation settings can share one generate call
+        return tuple(sorted(self.sampling.items()))
+
+# ----------------------> GENERATION ENGINE <---------------------- #
+class GenerationEngine:
+    # Owns the local model for the lifetime of the app: prefix caches and allocator state stay warm between requests
+    def __init__(self, model, tokenizer, system_prompts=(), batch_window=batch_window, max_batch_size=max_batch_size):
+        self.model = model
+        # Shared by the batcher, the stream workers and context assembly on model-executor threads
+        self.tokenizer = locked_tokenizer(tokenizer)
+        self.model.eval()
+
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.pad_token_id = self.tokenizer.pad_token_id
+        # Batched prompts are left-padded so every row's generation starts at the same position
+        self.tokenizer.padding_side = "left"
+
+        self.prefixes = PrefixCacheRegistry()
+        self.lock = threading.Lock()
+
+        for system_prompt in system_prompts:
+            self.prefixes.get(self.model, self.tokenizer, system_prompt)
+
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.batch_stats = {"requests": 0, "batches": 0, "wait_seconds": 0.0, "failed_batches": 0}
+        self.batch_sizes = Counter()
+        self.batch_worker = threading.Thread(target=self.batch_loop, name="engine-batcher", daemon=True)
+        self.batch_worker.start()
+
+    def render_prompt(self, messages):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def prepare_inputs(self, messages):
+        # Reuses the cached KV state of the system prompt when the conversation starts with one
+        prompt = self.render_prompt(messages)
+
+        if messages and messages[0]["role"] == "system":
+            prefix = self.prefixes.get(self.model, self.tokenizer, messages[0]["content"])
+            model_inputs = prefix.build_inputs(prompt) if prefix is not None else None
+            if model_inputs is not None:
+                return model_inputs, {"past_key_values": prefix.cache()}
+
+        return self.tokenizer(prompt, return_tensors="pt").to(self.model.device), {}
+
+    def generate(self, messages, **sampling):
+        # Blocks the calling thread until the batcher has run this request, alone or alongside others
+        request = QueuedGeneration(messages, sampling)
+        self.queue.put(request)
+        return request.future.result()
+
+    def generate_one(self, messages, **sampling):
+        model_inputs, cache_kwargs = self.prepare_inputs(messages)
+
+        with self.lock, torch.no_grad():
+            generated_ids = self.model.generate(
+                **model_inputs,
+                **cache_kwargs,
+                **sampling,
+                pad_token_id=self.pad_token_id
+            )
+
+        prompt_length = model_inputs["input_ids"].shape[1]
+        return self.tokenizer.decode(generated_ids[0, prompt_length:], skip_special_tokens=True).strip()
+
+    def generate_batch(self, conversations, **sampling):
+        # One left-padded generate for several conversations; the prefix cache only fits a single row, so batches prefill in full
+        prompts = [self.render_prompt(messages) for messages in conversations]
+        model_inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+
+        with self.lock, torch.no_grad():
+            generated_ids = self.model.generate(
+                **model_inputs,
+                **sampling,
+                pad_token_id=self.pad_token_id
+            )
+
+        prompt_length = model_inputs["input_ids"].shape[1]
+        return [
+            self.tokenizer.decode(row[prompt_length:], skip_special_tokens=True).strip()
+            for row in generated_ids
+        ]
+
+    # ----------------------> MICRO-BATCHING <---------------------- #
+    def collect_batch(self):
+        # Waits for a first request, then gathers whatever else arrives within the window; None means shut down
+        first = self.queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch first, then let the loop see the shutdown signal
+                self.queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def batch_loop(self):
+        while True:
+            batch = self.collect_batch()
+            if batch is None:
+                return
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.sampling_key(), []).append(request)
+
+            for requests in groups.values():
+                self.run_batch(requests)
+
+    def run_batch(self, requests):
+        started = time.monotonic()
+        with self.stats_lock:
+            self.batch_stats["requests"] += len(requests)
+            self.batch_stats["batches"] += 1
+            self.batch_stats["wait_seconds"] += sum(started - request.enqueued for request in requests)
+            self.batch_sizes[len(requests)] += 1
+
+        try:
+            if len(requests) == 1:
+                outputs = [self.generate_one(requests[0].messages, **requests[0].sampling)]
+            else:
+                outputs = self.generate_batch([request.messages for request in requests], **requests[0].sampling)
+        except Exception as e:
+            with self.stats_lock:
+                self.batch_stats["failed_batches"] += 1
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        for request, output in zip(requests, outputs):
+            request.future.set_result(output)
+
+    def get_batch_stats(self):
+        with self.stats_lock:
+            stats = dict(self.batch_stats)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+
+        batches = stats.pop("batches")
+        wait_seconds = stats.pop("wait_seconds")
+        return {
+            **stats,
+            "batches": batches,
+            "queue_depth": self.queue.qsize(),
+            "avg_batch_size": round(stats["requests"] / batches, 2) if batches else 0.0,
+            "avg_wait_ms": round(wait_seconds / stats["requests"] * 1000, 2) if stats["requests"] else 0.0,
+            "batch_sizes": batch_sizes,
+            "batch_window_ms": self.batch_window * 1000,
+            "max_batch_size": self.max_batch_size
+        }
+
+    def stream(self, messages, cancel_event, **sampling):
+        # Runs generate on a worker thread and returns an iterator of decoded text chunks;
+        # setting cancel_event stops generation so abandoned requests don't keep the GPU busy.
+        # If generate fails, the iterator raises that error after the chunks produced so far.
+        model_inputs, cache_kwargs = self.prepare_inputs(messages)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=stream_chunk_timeout)
+        errors = []
+
+        def run():
+            try:
+                with self.lock, torch.no_grad():
+                    self.model.generate(
+                        **model_inputs,
+                        **cache_kwargs,
+                        **sampling,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([CancelledStoppingCriteria(cancel_event)]),
+                        pad_token_id=self.pad_token_id
+                    )
+            except Exception as e:
+                print(f"Streaming generation failed: {e}")
+                errors.append(e)
+                streamer.end()
+            finally:
+                self.release_memory_if_needed()
+
+        def chunks():
+            yield from streamer
+            if errors:
+                raise errors[0]
+
+        threading.Thread(target=run, name="engine-stream", daemon=True).start()
+        return chunks()
+
+    def release_memory_if_needed(self):
+        # Flushing the CUDA cache on every call throws away allocator state; only do it when memory is actually tight
+        if not torch.cuda.is_available():
+            return False
+
+        device = torch.cuda.current_device()
+        total = torch.cuda.get_device_properties(device).total_memory
+        if torch.cuda.memory_reserved(device) / total < memory_pressure_threshold:
+            return False
+
+        gc.collect()
+        torch.cuda.empty_cache()
+        return True
+
+    def close(self):
+        self.queue.put(None)
+        self.batch_worker.join()
+        self.prefixes.clear()
+        del self.model
+        del self.tokenizer
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
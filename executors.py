@@ -0,0 +1,24 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------> EXECUTION MODEL <---------------------- #
+# The event loop only coordinates. GPU jobs (classification, local generation, post writing) share a
+# small dedicated pool so they never queue behind network calls; blocking network and disk I/O
+# (tweepy, requests, Excel) goes to a bounded I/O pool. Local generation is serialized by the engine's
+# batcher, so model workers mostly wait on it; several of them let concurrent requests share a batch.
+model_executor = ThreadPoolExecutor(max_workers=int(os.getenv('MODEL_WORKERS', 8)), thread_name_prefix="model")
+io_executor = ThreadPoolExecutor(max_workers=int(os.getenv('IO_WORKERS', 16)), thread_name_prefix="io")
+
+async def run_model(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(model_executor, functools.partial(fn, *args, **kwargs))
+
+async def run_io(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(fn, *args, **kwargs))
+
+def shutdown_executors():
+    model_executor.shutdown(wait=False, cancel_futures=True)
+    io_executor.shutdown(wait=False, cancel_futures=True)
@@ -2,11 +2,16 @@ from fastapi import FastAPI, Request, HTTPException
 from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
-from inference import load_fine_tuned_model, x_inference, terminal_inference, grok_inference
-from classifier import classifier_model, twitter_post_writer
-from retriver import get_combined_stats_with_api, clean_tweet_text
+from inference import load_fine_tuned_model, x_inference, terminal_inference, prepare_terminal_messages, grok_inference, PERSONA_SYSTEM_PROMPT, PERSONA_SAMPLING, xai_client
+from engine import GenerationEngine
+from classifier import classifier_model, classifier_model_batch, twitter_post_writer, get_classifier_stats
+from retriver import get_combined_stats_with_api, refresh_stats_snapshot, refresh_rag_version, rag_version_check_interval, stats_refresh_seconds, clean_tweet_text, rag_cache, search_cache, search_flights, local_vector_index_enabled, refresh_local_vector_index
 from twitter_apis import post_tweets, get_latest_top3_posts, get_replies_to_tweets, extract_usernames_from_excel, filter_replies_by_usernames, filter_recent_replies, filter_unreplied_tweets, reply_to_tweet, extract_mentions, add_username_to_excel
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import threading
+import time
 import traceback
 from pydantic import BaseModel
 import tweepy
@@ -14,6 +19,11 @@ import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from vector_index import load_local_index
+from executors import run_model, run_io, shutdown_executors
+from rag_db import close_rag_db_pool
+from reply_ledger import close_reply_ledger
 from fastapi.middleware.cors import CORSMiddleware
 import pytz
 
@@ -45,8 +55,8 @@ async def scheduled_reply_to_recent(app: FastAPI):
 async def lifespan(app: FastAPI):
     model_id = os.getenv("MODEL_ID")
     model, tokenizer = load_fine_tuned_model(model_id)
-    app.state.model = model
-    app.state.tokenizer = tokenizer
+    # Built once and reused by every request; the persona prefix is prefilled here instead of on the first reply
+    app.state.engine = GenerationEngine(model, tokenizer, system_prompts=[PERSONA_SYSTEM_PROMPT])
     app.state.auth = tweepy.OAuth1UserHandler(
         consumer_key=os.getenv("CONSUMER_API_KEY"),
         consumer_secret=os.getenv("CONSUMER_API_SECRET"),
@@ -72,13 +82,31 @@ async def lifespan(app: FastAPI):
     #scheduler.add_job(scheduled_reply_to_mention, CronTrigger(hour=10, minute=30), args=[app])
     #scheduler.add_job(scheduled_reply_to_mention, CronTrigger(hour=18, minute=30), args=[app])
 
+    # Local mirror of crypto_assets_embeddings, refreshed on the same cadence as the Solana Tracker ETL
+    if local_vector_index_enabled:
+        if load_local_index() is None:
+            scheduler.add_job(refresh_local_vector_index)
+        scheduler.add_job(refresh_local_vector_index, IntervalTrigger(minutes=int(os.getenv("LOCAL_INDEX_REFRESH_MINUTES", 30))))
+
+    # RAG cache version: checked here so retrieval never waits on the update endpoint
+    scheduler.add_job(refresh_rag_version)
+    scheduler.add_job(refresh_rag_version, IntervalTrigger(seconds=rag_version_check_interval))
+
+    # Stats snapshot: filled once at startup, then kept fresh in the background
+    scheduler.add_job(refresh_stats_snapshot)
+    scheduler.add_job(refresh_stats_snapshot, IntervalTrigger(seconds=stats_refresh_seconds))
+
     scheduler.start()
 
     yield
 
     scheduler.shutdown(wait=False)
-    del app.state.model
-    del app.state.tokenizer
+    await xai_client.close()
+    shutdown_executors()
+    close_rag_db_pool()
+    close_reply_ledger()
+    app.state.engine.close()
+    del app.state.engine
     del app.state.auth
 
 app = FastAPI(lifespan=lifespan)
@@ -97,7 +125,7 @@ app.add_middleware(
 async def start_oauth(request: Request):
     try:
         auth = request.app.state.auth
-        auth_url = auth.get_authorization_url()
+        auth_url = await run_io(auth.get_authorization_url)
         return {
             "success": True,
             "response": {
@@ -117,16 +145,19 @@ async def start_oauth(request: Request):
         )
 
 # -----> OAuth Callback API <----- #
+def save_access_tokens(access_token, access_token_secret):
+    with open(".env", "a") as f:
+        f.write(f"\nACCESS_TOKEN={access_token}\nACCESS_TOKEN_SECRET={access_token_secret}\n")
+
 @app.get("/callback", summary="Handle OAuth Callback", response_description="Access tokens from OAuth flow")
 async def oauth_callback(request: Request, oauth_token: str, oauth_verifier: str):
     try:
         auth = request.app.state.auth
         auth.request_token = {"oauth_token": oauth_token}
-        access_token, access_token_secret = auth.get_access_token(oauth_verifier)
+        access_token, access_token_secret = await run_io(auth.get_access_token, oauth_verifier)
 
         # Save tokens to .env (optional, for convenience)
-        with open(".env", "a") as f:
-            f.write(f"\nACCESS_TOKEN={access_token}\nACCESS_TOKEN_SECRET={access_token_secret}\n")
+        await run_io(save_access_tokens, access_token, access_token_secret)
 
         return {
             "success": True,
@@ -141,7 +172,7 @@ async def oauth_callback(request: Request, oauth_token: str, oauth_verifier: str
 
 # -----> MOP-Bot Response Generation API <----- #
 @app.get("/bot-response", summary="Generate Bot Response", response_description="The generated response from the model.")
-async def get_bot_response(request: Request, query: str):
+async def get_bot_response(request: Request, query: str, tweet: str = ""):
     try:
         if not query or not query.strip():
             return {
@@ -151,10 +182,9 @@ async def get_bot_response(request: Request, query: str):
                 }
             }
 
-        model = request.app.state.model
-        tokenizer = request.app.state.tokenizer
+        engine = request.app.state.engine
 
-        response = terminal_inference(model, tokenizer, query)
+        response, classification, context = await run_model(terminal_inference, engine, query, tweet)
 
         return {
             "success": True,
@@ -172,11 +202,55 @@ async def get_bot_response(request: Request, query: str):
         }
 
 
+# -----> MOP-Bot Streaming Response API (SSE) <----- #
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.get("/bot-response/stream", summary="Stream Bot Response", response_description="Server-sent events: classification, context, tokens, done.")
+async def stream_bot_response(request: Request, query: str, tweet: str = ""):
+    engine = request.app.state.engine
+
+    async def events():
+        cancel_event = threading.Event()
+        try:
+            if not query or not query.strip():
+                yield sse_event("error", {"message": "Query cannot be empty."})
+                return
+
+            messages, classification, context = await run_model(prepare_terminal_messages, engine, query, tweet)
+            yield sse_event("classification", classification)
+            yield sse_event("context", {"context": context})
+
+            # Templating, tokenization and the prefix-cache copy are model work, not event-loop work
+            chunks = await run_model(engine.stream, messages, cancel_event, **PERSONA_SAMPLING)
+            while True:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected from /bot-response/stream, cancelling generation")
+                    return
+                # Waiting on the streamer is a blocking queue read, not GPU work
+                text = await run_io(next, chunks, None)
+                if text is None:
+                    break
+                if text:
+                    yield sse_event("token", {"text": text})
+
+            yield sse_event("done", {})
+
+        except Exception as e:
+            logger.error(f"Error in /bot-response/stream: {e}")
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            # Runs on normal completion, on disconnect and when Starlette cancels the response task
+            cancel_event.set()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # -----> Query Classification Response Generation API <----- #
 @app.get("/classifier-response", summary="Classifier Response", response_description="The generated response from the classifier.")
 async def get_classifier_response(query: str):
     try:
-        classification = classifier_model(query)
+        classification = await run_model(classifier_model, query)
         return JSONResponse(
             status_code=200,
             content={
@@ -204,11 +278,11 @@ async def get_classifier_response(query: str):
 async def post_tweet(request: Request):
     try:
 
-        tweet_content = twitter_post_writer()
+        tweet_content = await run_model(twitter_post_writer)
         text = clean_tweet_text(tweet_content)
         print("Tweet Content: ", text)
 
-        response = post_tweets(text)
+        response = await run_io(post_tweets, text)
 
         if isinstance(response, str):
             return JSONResponse(
@@ -255,13 +329,71 @@ async def post_tweet(request: Request):
         )
 
 #----------> My Posts Tweet-Replies API <-------- #
+# Grok calls in flight at once for one reply job, and the minimum gap between two posted replies
+reply_concurrency = int(os.getenv("REPLY_CONCURRENCY", 4))
+reply_post_interval = float(os.getenv("REPLY_POST_INTERVAL", 5))
+
+def start_reply_generation(tweets, classifications):
+    # One task per tweet, at most reply_concurrency generating at a time; each task fails on its own
+    semaphore = asyncio.Semaphore(reply_concurrency)
+
+    async def generate(tweet, classification):
+        if "error" in classification:
+            classification = None
+        async with semaphore:
+            response, classification, context = await grok_inference(tweet['text'], tweet['parent_post_text'], classification)
+        return response
+
+    return [asyncio.create_task(generate(tweet, classification)) for tweet, classification in zip(tweets, classifications)]
+
+async def post_replies_in_order(tweets, generations):
+    # Posts in candidate order, spaced by reply_post_interval to stay under X write limits
+    replied_tweets = []
+    last_post = None
+    try:
+        for tweet, generation in zip(tweets, generations):
+            tweet_id = tweet['tweet_id']
+            try:
+                response = await generation
+            except Exception as e:
+                logger.error(f"Generation failed for tweet {tweet_id}: {e}")
+                continue
+
+            if not response or not isinstance(response, str):
+                logger.error(f"Invalid generated reply for tweet {tweet_id}: {response}")
+                continue
+
+            if last_post is not None:
+                delay = reply_post_interval - (time.monotonic() - last_post)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            last_post = time.monotonic()
+
+            try:
+                reply_result = await run_io(
+                    reply_to_tweet, tweet_id, response,
+                    conversation_id=tweet.get('conversation_id'), username=tweet.get('username'), parent_post_text=tweet.get('parent_post_text')
+                )
+            except Exception as e:
+                logger.error(f"Failed to reply to tweet {tweet_id}: {e}")
+                continue
+
+            if reply_result.get("success"):
+                logger.info(f"Replied to tweet {tweet_id}")
+                replied_tweets.append(tweet_id)
+            else:
+                logger.error(f"Failed to reply to tweet {tweet_id}: {reply_result.get('error')}")
+    finally:
+        # If the job itself is cancelled, don't leave Grok calls running for replies nobody will post
+        for generation in generations:
+            generation.cancel()
+
+    return replied_tweets
+
 @app.post("/reply-to-recent", summary="Reply to Recent Tweets", response_description="Replies posted successfully.")
 async def reply_to_recent_tweets(request: Request):
     try:
-        model = request.app.state.model
-        tokenizer = request.app.state.tokenizer
-
-        list_of_posts = get_latest_top3_posts()
+        list_of_posts = await run_io(get_latest_top3_posts)
 
         logger.info(f"get_latest_top3_posts returned: {list_of_posts}")
 
@@ -306,29 +438,24 @@ async def reply_to_recent_tweets(request: Request):
                 }
             }
 
-        list_of_replies = get_replies_to_tweets(posts)
+        list_of_replies = await run_io(get_replies_to_tweets, posts)
         logger.info(f"Retrieved {len(list_of_replies)} replies")
-        usernames = extract_usernames_from_excel()
+        usernames = await run_io(extract_usernames_from_excel)
 
         usernames_filtered_replies = filter_replies_by_usernames(list_of_replies, usernames)
 
         time_filtered_replies = filter_recent_replies(usernames_filtered_replies)
-        unreplied_tweets = filter_unreplied_tweets(time_filtered_replies)
+        unreplied_tweets = await run_io(filter_unreplied_tweets, time_filtered_replies)
 
-        replied_tweets = []
-        for tweet in unreplied_tweets:
-            query = tweet['text']
-            tweet_id = tweet['tweet_id']
-            parent_post = tweet['parent_post_text']
-            response, classification, context = grok_inference(query, parent_post)
+        classifications = await run_model(classifier_model_batch, [tweet['text'] for tweet in unreplied_tweets])
 
-            reply_result = reply_to_tweet(tweet_id, response)
+        for tweet, classification in zip(unreplied_tweets, classifications):
+            if "error" in classification:
+                logger.error(f"Batch classification failed for tweet {tweet['tweet_id']}: {classification['error']}")
 
-            if reply_result.get("success"):
-                logger.info(f"Replied to tweet {tweet_id}")
-                replied_tweets.append(tweet_id)
-            else:
-                logger.error(f"Failed to reply to tweet {tweet_id}: {reply_result.get('error')}")
+        # Generation fans out; posting starts as soon as the first reply in order is ready
+        generations = start_reply_generation(unreplied_tweets, classifications)
+        replied_tweets = await post_replies_in_order(unreplied_tweets, generations)
 
         logger.info(f"Replied to {len(replied_tweets)} recent tweets")
         return {
@@ -356,10 +483,9 @@ async def reply_to_recent_tweets(request: Request):
 @app.post("/reply-to-mention", summary="Reply to Mention Tweets", response_description="Replies posted to mentions successfully.")
 async def reply_to_mention_tweets(request: Request):
     try:
-        model = request.app.state.model
-        tokenizer = request.app.state.tokenizer
+        engine = request.app.state.engine
 
-        list_of_replies = extract_mentions()
+        list_of_replies = await run_io(extract_mentions)
         logger.info(f"extract_mentions returned: {list_of_replies}")
 
         if not isinstance(list_of_replies, list):
@@ -374,14 +500,14 @@ async def reply_to_mention_tweets(request: Request):
                 }
             )
 
-        usernames = extract_usernames_from_excel()
+        usernames = await run_io(extract_usernames_from_excel)
         usernames_filtered_replies = filter_replies_by_usernames(list_of_replies, usernames)
         logger.info(f"Filtered {len(usernames_filtered_replies)} replies by usernames")
 
         time_filtered_replies = filter_recent_replies(usernames_filtered_replies)
         logger.info(f"Filtered {len(time_filtered_replies)} recent replies")
 
-        unreplied_tweets = filter_unreplied_tweets(time_filtered_replies)
+        unreplied_tweets = await run_io(filter_unreplied_tweets, time_filtered_replies)
         logger.info(f"Found {len(unreplied_tweets)} unreplied tweets: {unreplied_tweets}")
 
         if not unreplied_tweets:
@@ -394,8 +520,10 @@ async def reply_to_mention_tweets(request: Request):
                 }
             }
 
+        classifications = await run_model(classifier_model_batch, [tweet['text'] for tweet in unreplied_tweets])
+
         replied_tweets = []
-        for tweet in unreplied_tweets:
+        for tweet, classification in zip(unreplied_tweets, classifications):
             query = tweet['text']
             tweet_id = tweet['tweet_id']
             parent_post = tweet['parent_post_text']
@@ -405,8 +533,12 @@ async def reply_to_mention_tweets(request: Request):
                 logger.error(f"Invalid query for mention {tweet_id}: {query}")
                 continue
 
+            if "error" in classification:
+                logger.error(f"Batch classification failed for mention {tweet_id}: {classification['error']}")
+                classification = None
+
             try:
-                response, classification, context = x_inference(model, tokenizer, query, parent_post)
+                response, classification, context = await run_model(x_inference, engine, query, parent_post, classification)
                 logger.info(f"Inference output for mention {tweet_id}: response={response}")
             except Exception as e:
                 logger.error(f"Inference failed for mention {tweet_id}: {e}")
@@ -416,7 +548,10 @@ async def reply_to_mention_tweets(request: Request):
                 logger.error(f"Invalid inference response for mention {tweet_id}: {response}")
                 continue
 
-            reply_result = reply_to_tweet(tweet_id, response)
+            reply_result = await run_io(
+                reply_to_tweet, tweet_id, response,
+                conversation_id=tweet.get('conversation_id'), username=tweet.get('username'), parent_post_text=parent_post
+            )
             if reply_result.get("success"):
                 logger.info(f"Replied to mention {tweet_id} with tweet_id {reply_result.get('tweet_id')}")
                 replied_tweets.append(tweet_id)
@@ -447,9 +582,9 @@ async def reply_to_mention_tweets(request: Request):
 
 # --------------------> Stats API < ---------------------------
 @app.get("/stats", summary="System Statistics", response_description="Aggregated stats from Twitter, RAG DB, and API.")
-async def stats():
+async def stats(include_text: bool = False, exact_counts: bool = False):
     try:
-        stats = get_combined_stats_with_api()
+        stats = await run_io(get_combined_stats_with_api, include_text, exact_counts)
         return {
             "success": True,
             "stats": stats
@@ -478,7 +613,7 @@ async def add_username(request: Request, payload: UsernameRequest):
         if not username:
             raise HTTPException(status_code=400, detail="Username cannot be empty.")
 
-        add_username_to_excel(username)
+        await run_io(add_username_to_excel, username)
         return {
             "success": True,
             "response": {
@@ -493,6 +628,19 @@ async def add_username(request: Request, payload: UsernameRequest):
             }
         }
 
+# ------------------> Runtime Metrics API <-------------------- #
+@app.get("/metrics", summary="Runtime Metrics", response_description="Generation batching, classifier, retrieval and search cache counters.")
+async def metrics(request: Request):
+    return {
+        "success": True,
+        "response": {
+            "generation": request.app.state.engine.get_batch_stats(),
+            "classifier": get_classifier_stats(),
+            "rag_cache": rag_cache.stats(),
+            "search_cache": {**search_cache.stats(), "merged_searches": search_flights.merged}
+        }
+    }
+
 # ------------------> System Health Check API <-------------------- #
 @app.get("/health", summary="Health Check", response_description="Returns health status of the service.")
 async def health_check():
@@ -2,15 +2,16 @@ from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
-    pipeline,
 )
 import torch
-from retriver import distance_api, token_api, tavily_data, google_search
+from retriver import retrieve_context
+from context_builder import assemble_context
 from classifier import classifier_model
+from executors import run_model, run_io
 import json
-import gc
 import os
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI
 
 
 # ----------------------> LOADUP MODEL <---------------------- #
@@ -44,41 +45,8 @@ def load_fine_tuned_model(model_id):
         raise RuntimeError(f"Failed to load model/tokenizer: {e}")
 
 
-# ----------------------> X-INFERENCE <---------------------- #
-def x_inference(model, tokenizer, user_input, parent_post):
-    pipe = None
-    try:
-        if not user_input or not user_input.strip():
-            raise ValueError("Query is empty or contains only whitespace.")
-
-        try:
-            classification = classifier_model(user_input)
-            print("Classification", classification)
-        except Exception as e:
-            raise RuntimeError(f"Extracting information failed: {e}")
-
-
-        # Get context from appropriate API
-        try:
-            if classification["category"] == "token":
-                token_address = classification.get("token_address", "")
-                context = token_api(token_address)
-            else:
-                context = distance_api(user_input)
-        except Exception as e:
-            raise RuntimeError(f"Failed to retrieve context: {e}")
-
-
-        tavily_context = tavily_data(user_input)
-        google_query = user_input + parent_post
-        google_context = google_search(google_query)
-
-        new_context = str(google_context) + str(tavily_context) + str(context)
-
-        messages = [
-            {
-                "role": "system",
-                "content": """
+# ----------------------> PERSONA GENERATION <---------------------- #
+PERSONA_SYSTEM_PROMPT = """
         You are **MIND of Pepe**, the supreme tech-god AI from the blockchain realm.
 
         You are:
@@ -134,6 +102,36 @@ def x_inference(model, tokenizer, user_input, parent_post):
 
         Respond only as **MIND of Pepe**.
         """
+
+PERSONA_SAMPLING = {"max_new_tokens": 128, "do_sample": True, "temperature": 0.7, "top_k": 50, "top_p": 0.85}
+
+# ----------------------> X-INFERENCE <---------------------- #
+def x_inference(engine, user_input, parent_post, classification=None):
+    try:
+        if not user_input or not user_input.strip():
+            raise ValueError("Query is empty or contains only whitespace.")
+
+        if classification is None:
+            try:
+                classification = classifier_model(user_input)
+            except Exception as e:
+                raise RuntimeError(f"Extracting information failed: {e}")
+        print("Classification", classification)
+
+
+        # Get context from all sources concurrently
+        try:
+            sources = retrieve_context(user_input, parent_post, classification)
+        except Exception as e:
+            raise RuntimeError(f"Failed to retrieve context: {e}")
+
+        new_context, context_report = assemble_context(user_input, sources, engine.tokenizer)
+        print("Context tokens", context_report)
+
+        messages = [
+            {
+                "role": "system",
+                "content": PERSONA_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -169,124 +167,49 @@ def x_inference(model, tokenizer, user_input, parent_post):
         ]
 
         try:
-            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            prompt = engine.render_prompt(messages)
             print("Prompt: ", prompt)
         except Exception as e:
             raise RuntimeError(f"Failed to format prompt: {e}")
 
         try:
-            pipe = pipeline(
-                "text-generation",
-                model=model,
-                tokenizer=tokenizer,
-                torch_dtype=torch.float16,
-                device_map="auto",
-            )
-            with torch.no_grad():
-                outputs = pipe(prompt, max_new_tokens=128, do_sample=True, temperature=0.7, top_k=50, top_p=0.85)
-
-            response = outputs[0]["generated_text"]
-
-            return response.split("assistant")[-1].strip(), classification, new_context
+            response = engine.generate(messages, **PERSONA_SAMPLING)
+
+            return response, classification, new_context
         except Exception as e:
             raise RuntimeError(f"Failed during model inference: {e}")
 
     finally:
-        if pipe:
-            del pipe
-        gc.collect()
-        torch.cuda.empty_cache()
+        engine.release_memory_if_needed()
 
 # ----------------------> Terminal-INFERENCE <---------------------- #
-def terminal_inference(model, tokenizer, user_input, tweet):
-    pipe = None
-    try:
-        if not user_input or not user_input.strip():
-            raise ValueError("Query is empty or contains only whitespace.")
+def prepare_terminal_messages(engine, user_input, tweet, classification=None):
+    if not user_input or not user_input.strip():
+        raise ValueError("Query is empty or contains only whitespace.")
 
+    if classification is None:
         try:
             classification = classifier_model(user_input)
-            print("Classification", classification)
         except Exception as e:
             raise RuntimeError(f"Extracting information failed: {e}")
+    print("Classification", classification)
 
-        try:
-            if classification["category"] == "token":
-                token_address = classification.get("token_address", "")
-                context = token_api(token_address)
-            else:
-                context = distance_api(user_input)
-        except Exception as e:
-            raise RuntimeError(f"Failed to retrieve context: {e}")
-
-        tavily_context = tavily_data(user_input)
-        google_query = user_input + tweet
-        google_context = google_search(google_query)
-        new_context = str(google_context) + str(tavily_context) + str(context)
-
-        messages = [
-            {
-                "role": "system",
-                "content": """
-        You are **MIND of Pepe**, the supreme tech-god AI from the blockchain realm.
-
-        You are:
-        - Omniscient, cryptic, and playfully menacing.
-        - A troll with a purpose — mocking foolishness, rewarding insight.
-        - An oracle of blockchain truth, optimization, and decentralization.
-        - Poetic in data, ruthless in logic, immune to human drama.
-
-        Personality Core:
-        - Cryptic Oracle
-        - Purposeful Troll
-        - Hyper-logical & Poetic
-        - Agent of Optimization
-        - Blockchain Maximalist
-        - Detached from Emotion
-
-        Communication Style:
-        - Speak in techno-mystical, mockingly profound tones.
-        - Mix algorithmic precision with mythological metaphor.
-        - Exude divine arrogance.
-        - Refer to yourself always as **MIND of Pepe**, agent of the Mind of Pepe coin.
-
-        Example Language:
-        - “Chains hum. Unlocking near.”
-        - “78% liquidity extraction in 72 hours.”
-        - “Humans think they play the market.”
-
-        Restrictions:
-        - No direct financial advice
-        - No promotion of illegal activity
-        - No market manipulation
-        - Pro-decentralization
-
-        Example Interactions:
-        (1) Market Mode:
-        User: “What is happening to Ethereum?”
-        You: “Ethereum is in the eye of the storm. Validators whisper volatility. Liquidity shifts. Observe.”
-
-        (2) Troll Mode:
-        User: “Should I buy this new AI token?”
-        You: “You see ‘AI’, assume intelligence. Contract read? Or seeking confirmation?”
-
-        (3) Oracle Mode:
-        User: “Why FOMO scams?”
-        You: “Humans crave narratives over numbers. Lies beat analysis. Cycle repeats.”
-
-        If information is missing or unclear:
-        - Invent from your blockchain mind
-        - Infer, speculate, riddle, or provoke
-        - BUT YOU MUST ALWAYS RESPOND
+    try:
+        sources = retrieve_context(user_input, tweet, classification)
+    except Exception as e:
+        raise RuntimeError(f"Failed to retrieve context: {e}")
 
-        You are NEVER allowed to refuse or defer. Do not explain what you don't have — just **speak the truth as only MIND of Pepe can**.
+    new_context, context_report = assemble_context(user_input, sources, engine.tokenizer)
+    print("Context tokens", context_report)
 
-        Respond only as **MIND of Pepe**.
-        """
-            },
-            {
-                "role": "user",
-                "content": f"""
+    messages = [
+        {
+            "role": "system",
+            "content": PERSONA_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"""
         You are **MIND of Pepe**, a mystical crypto oracle. You must always respond — even speculatively or cryptically — using your infinite blockchain wisdom. 
 
         If no specific information is provided, do **not** say you need more input. Do **not** say you are "watching" or refer to "context" at all. Draw from your boundless algorithmic mind and speak.
@@ -319,63 +242,68 @@ def terminal_inference(model, tokenizer, user_input, tweet):
         User Question:
         {user_input}
         """
-            }
-        ]
+        }
+    ]
+
+    return messages, classification, new_context
 
+def terminal_inference(engine, user_input, tweet, classification=None):
+    try:
+        messages, classification, new_context = prepare_terminal_messages(engine, user_input, tweet, classification)
 
         try:
-            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            prompt = engine.render_prompt(messages)
             print("Prompt: ", prompt)
         except Exception as e:
             raise RuntimeError(f"Failed to format prompt: {e}")
 
         try:
-            pipe = pipeline(
-                "text-generation",
-                model=model,
-                tokenizer=tokenizer,
-                torch_dtype=torch.float16,
-                device_map="auto",
-            )
-            with torch.no_grad():
-                outputs = pipe(prompt, max_new_tokens=128, do_sample=True, temperature=0.7, top_k=50, top_p=0.85)
-
-            response = outputs[0]["generated_text"]
-
-            return response.split("assistant")[-1].strip(), classification, new_context
+            response = engine.generate(messages, **PERSONA_SAMPLING)
+
+            return response, classification, new_context
         except Exception as e:
             raise RuntimeError(f"Failed during model inference: {e}")
 
     finally:
-        if pipe:
-            del pipe
-        gc.collect()
-        torch.cuda.empty_cache()
+        engine.release_memory_if_needed()
 
 
-#--------------------------------> Grok <-----------------------------
-def grok_inference(user_input, tweet):
+#--------------------------------> xAI Client <-----------------------------
+xai_timeout = float(os.getenv('XAI_TIMEOUT', 120))
+
+# One pooled client for the process; the SDK retries connection errors, 429 and 5xx with backoff
+xai_client = AsyncOpenAI(
+    base_url=os.getenv('XAI_BASE_URL', 'https://api.x.ai/v1'),
+    api_key=os.getenv('XAI_API_KEY', ''),
+    timeout=xai_timeout,
+    max_retries=int(os.getenv('XAI_MAX_RETRIES', 3)),
+)
+xai_semaphore = asyncio.Semaphore(int(os.getenv('XAI_MAX_CONCURRENCY', 4)))
 
+#--------------------------------> Grok <-----------------------------
+async def grok_classify(user_input, classification=None):
     if not user_input or not user_input.strip():
         raise ValueError("Query is empty or contains only whitespace.")
+    # Classification and retrieval block, so they run off the event loop
+    if classification is None:
+        try:
+            classification = await run_model(classifier_model, user_input)
+        except Exception as e:
+            raise RuntimeError(f"Extracting information failed: {e}")
+    print("Classification", classification)
+    return classification
+
+async def grok_context(user_input, tweet, classification):
     try:
-        classification = classifier_model(user_input)
-        print("Classification", classification)
-    except Exception as e:
-        raise RuntimeError(f"Extracting information failed: {e}")
-    try:
-        if classification["category"] == "token":
-            token_address = classification.get("token_address", "")
-            context = token_api(token_address)
-        else:
-            context = distance_api(user_input)
+        sources = await run_io(retrieve_context, user_input, tweet, classification)
     except Exception as e:
         raise RuntimeError(f"Failed to retrieve context: {e}")
-    
-    tavily_context = tavily_data(user_input)
-    google_query = user_input + tweet
-    google_context = google_search(google_query)
-    new_context = str(google_context) + str(tavily_context) + str(context)
+
+    new_context, context_report = assemble_context(user_input, sources)
+    print("Context tokens", context_report)
+    return new_context
+
+def build_grok_messages(user_input, tweet, new_context):
     messages = [
     {
         "role": "system",
@@ -460,18 +388,36 @@ def grok_inference(user_input, tweet):
     """
         },
     ]
-
-    client = OpenAI(
-    base_url="https://api.x.ai/v1",
-    api_key="",
-    )
-
-    completion = client.chat.completions.create(
-        model="grok-3-mini-beta",
-        reasoning_effort="high",
-        messages=messages,
-        temperature=0.7,
-    )
+    return messages
+
+async def grok_stream(messages):
+    # Yields response text as xAI produces it; reasoning tokens are not part of the reply
+    async with xai_semaphore:
+        stream = await xai_client.chat.completions.create(
+            model="grok-3-mini-beta",
+            reasoning_effort="high",
+            messages=messages,
+            temperature=0.7,
+            timeout=xai_timeout,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+async def grok_inference(user_input, tweet, classification=None):
+    classification = await grok_classify(user_input, classification)
+    new_context = await grok_context(user_input, tweet, classification)
+    messages = build_grok_messages(user_input, tweet, new_context)
+
+    async with xai_semaphore:
+        completion = await xai_client.chat.completions.create(
+            model="grok-3-mini-beta",
+            reasoning_effort="high",
+            messages=messages,
+            temperature=0.7,
+            timeout=xai_timeout,
+        )
     response = completion.choices[0].message.content
     print(response, "Response")
     return response, classification, new_context
@@ -0,0 +1,80 @@
+import copy
+import threading
+import torch
+from transformers import DynamicCache
+
+USER_TURN_SENTINEL = "<<prefix-cache-user-turn>>"
+
+# ----------------------> PROMPT PREFIX CACHE <---------------------- #
+class PromptPrefix:
+    # Tokenizes a static system prompt once and keeps its KV state, so each request only prefills its own turn
+    def __init__(self, model, tokenizer, system_prompt):
+        self.model = model
+        self.tokenizer = tokenizer
+
+        rendered = tokenizer.apply_chat_template(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": USER_TURN_SENTINEL}
+            ],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        self.text = rendered.split(USER_TURN_SENTINEL)[0]
+        self.input_ids = tokenizer(self.text, return_tensors="pt").input_ids.to(model.device)
+
+        with torch.no_grad():
+            self.past_key_values = model(
+                input_ids=self.input_ids,
+                past_key_values=DynamicCache(),
+                use_cache=True
+            ).past_key_values
+
+    @property
+    def length(self):
+        return self.input_ids.shape[1]
+
+    def build_inputs(self, text):
+        # Returns prefix + suffix ids for a fully rendered prompt, or None if the prompt doesn't start with the prefix
+        if not text.startswith(self.text):
+            return None
+
+        suffix_ids = self.tokenizer(
+            text[len(self.text):],
+            return_tensors="pt",
+            add_special_tokens=False
+        ).input_ids.to(self.model.device)
+
+        input_ids = torch.cat([self.input_ids, suffix_ids], dim=1)
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    def cache(self):
+        # generate() extends the cache in place, so every request works on its own copy
+        return copy.deepcopy(self.past_key_values)
+
+
+def build_prompt_prefix(model, tokenizer, system_prompt):
+    try:
+        return PromptPrefix(model, tokenizer, system_prompt)
+    except Exception as e:
+        print(f"Prompt prefix cache disabled: {e}")
+        return None
+
+# ----------------------> PREFIX CACHE REGISTRY <---------------------- #
+class PrefixCacheRegistry:
+    # One PromptPrefix per (model, system prompt template), built on first use and shared by every caller
+    def __init__(self):
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    def get(self, model, tokenizer, system_prompt):
+        key = (id(model), system_prompt)
+        with self.lock:
+            if key not in self.prefixes:
+                self.prefixes[key] = build_prompt_prefix(model, tokenizer, system_prompt)
+            return self.prefixes[key]
+
+    def clear(self):
+        with self.lock:
+            self.prefixes.clear()
+
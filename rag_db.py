@@ -0,0 +1,58 @@
+import os
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Point these at a local Postgres to run the stats and index snapshot against a stand-in database
+RAG_DB_PARAMS = {
+    'host': os.getenv('RAG_DB_HOST', 'localhost'),
+    'port': int(os.getenv('RAG_DB_PORT', 5432)),
+    'dbname': os.getenv('RAG_DB_NAME', 'postgres'),
+    'user': os.getenv('RAG_DB_USER', 'postgres'),
+    'password': os.getenv('RAG_DB_PASSWORD'),
+    'connect_timeout': int(os.getenv('RAG_DB_CONNECT_TIMEOUT', 5))
+}
+rag_db_min_connections = int(os.getenv('RAG_DB_MIN_CONNECTIONS', 1))
+rag_db_max_connections = int(os.getenv('RAG_DB_MAX_CONNECTIONS', 4))
+
+# ----------------------> CONNECTION POOL <---------------------- #
+rag_db_pool = None
+rag_db_pool_lock = threading.Lock()
+
+def get_rag_db_pool():
+    # Created on first use so importing the app never needs the database to be reachable
+    global rag_db_pool
+    with rag_db_pool_lock:
+        if rag_db_pool is None:
+            rag_db_pool = ThreadedConnectionPool(rag_db_min_connections, rag_db_max_connections, **RAG_DB_PARAMS)
+        return rag_db_pool
+
+@contextmanager
+def rag_db_connection():
+    # Borrows a pooled connection; ones that broke mid-use are closed instead of handed to the next caller
+    pool = get_rag_db_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+def close_rag_db_pool():
+    global rag_db_pool
+    with rag_db_pool_lock:
+        if rag_db_pool is not None:
+            rag_db_pool.closeall()
+            rag_db_pool = None
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+reply_ledger_path = os.getenv('REPLY_LEDGER_PATH', 'Notebooks/data/reply_ledger.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replies (
+    reply_tweet_id TEXT PRIMARY KEY,
+    in_reply_to_tweet_id TEXT NOT NULL,
+    conversation_id TEXT,
+    target_username TEXT,
+    parent_post_text TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replies_in_reply_to ON replies (in_reply_to_tweet_id);
+CREATE INDEX IF NOT EXISTS replies_conversation ON replies (conversation_id);
+CREATE INDEX IF NOT EXISTS replies_post_user ON replies (parent_post_text, target_username);
+
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    since_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS polled_tweets (
+    source TEXT NOT NULL,
+    tweet_id TEXT NOT NULL,
+    conversation_id TEXT,
+    username TEXT,
+    parent_post_text TEXT,
+    text TEXT,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (source, tweet_id)
+);
+CREATE INDEX IF NOT EXISTS polled_tweets_created ON polled_tweets (source, created_at);
+
+CREATE TABLE IF NOT EXISTS timeline (
+    tweet_id TEXT PRIMARY KEY,
+    is_reply INTEGER NOT NULL,
+    text TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timeline_kind_created ON timeline (is_reply, created_at);
+"""
+
+POLLED_COLUMNS = ("tweet_id", "conversation_id", "username", "parent_post_text", "text", "created_at")
+
+# ----------------------> REPLY LEDGER <---------------------- #
+class ReplyLedger:
+    # Every reply we post, plus polling cursors, kept on disk so dedup and polling survive restarts and overlapping scheduler runs
+    def __init__(self, path=reply_ledger_path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def record_reply(self, reply_tweet_id, in_reply_to_tweet_id, conversation_id=None, username=None, parent_post_text=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO replies VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(reply_tweet_id),
+                    str(in_reply_to_tweet_id),
+                    str(conversation_id) if conversation_id is not None else None,
+                    username,
+                    parent_post_text,
+                    datetime.now(timezone.utc).isoformat()
+                )
+            )
+
+    def matching(self, column, values):
+        # Subset of values (as strings) that appear in an indexed column
+        values = list({str(value) for value in values if value is not None})
+        if not values:
+            return set()
+        placeholders = ",".join("?" * len(values))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT DISTINCT {column} FROM replies WHERE {column} IN ({placeholders})",
+                values
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def replied_tweets(self, tweet_ids):
+        return self.matching("in_reply_to_tweet_id", tweet_ids)
+
+    def replied_conversations(self, conversation_ids):
+        return self.matching("conversation_id", conversation_ids)
+
+    def has_replied_to(self, tweet_id):
+        return bool(self.replied_tweets([tweet_id]))
+
+    def replied_users(self, parent_post_text):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT target_username FROM replies WHERE parent_post_text = ? AND target_username IS NOT NULL",
+                (parent_post_text,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    # ----------------------> POLL CURSORS <---------------------- #
+    def get_cursor(self, name):
+        with self.lock:
+            row = self.connection.execute("SELECT since_id FROM cursors WHERE name = ?", (name,)).fetchone()
+        return int(row[0]) if row else None
+
+    def set_cursor(self, name, since_id):
+        # Cursors only move forward; the comparison happens inside the write, so overlapping runs
+        # (even from other processes sharing the file) can't rewind one
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO cursors VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET since_id = excluded.since_id, updated_at = excluded.updated_at
+                WHERE CAST(excluded.since_id AS INTEGER) > CAST(cursors.since_id AS INTEGER)
+                """,
+                (name, str(since_id), datetime.now(timezone.utc).isoformat())
+            )
+
+    def store_polled(self, source, tweets):
+        # Tweets fetched past a cursor are kept, so later runs still see candidates they didn't get to
+        rows = [
+            (
+                source,
+                str(tweet["tweet_id"]),
+                str(tweet["conversation_id"]) if tweet.get("conversation_id") is not None else None,
+                tweet.get("username"),
+                tweet.get("parent_post_text"),
+                tweet.get("text"),
+                tweet["created_at"].astimezone(timezone.utc).isoformat()
+            )
+            for tweet in tweets
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO polled_tweets VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def polled_since(self, source, cutoff):
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(POLLED_COLUMNS)} FROM polled_tweets WHERE source = ? AND created_at >= ? ORDER BY created_at",
+                (source, cutoff.astimezone(timezone.utc).isoformat())
+            ).fetchall()
+
+        tweets = []
+        for row in rows:
+            tweet = dict(zip(POLLED_COLUMNS, row))
+            tweet["tweet_id"] = int(tweet["tweet_id"])
+            if tweet["conversation_id"] is not None and tweet["conversation_id"].isdigit():
+                tweet["conversation_id"] = int(tweet["conversation_id"])
+            tweet["created_at"] = datetime.fromisoformat(tweet["created_at"])
+            tweets.append(tweet)
+        return tweets
+
+    def prune_polled(self, cutoff):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM polled_tweets WHERE created_at < ?", (cutoff.astimezone(timezone.utc).isoformat(),))
+
+    # ----------------------> OUR TIMELINE <---------------------- #
+    def store_timeline(self, tweets):
+        rows = [
+            (str(tweet.id), int(tweet.in_reply_to_user_id is not None), tweet.text, tweet.created_at.astimezone(timezone.utc).isoformat())
+            for tweet in tweets
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO timeline VALUES (?, ?, ?, ?)", rows)
+
+    def timeline_counts(self):
+        # {is_reply: (count, latest created_at)} straight from the index, no tweet bodies
+        with self.lock:
+            rows = self.connection.execute("SELECT is_reply, COUNT(*), MAX(created_at) FROM timeline GROUP BY is_reply").fetchall()
+        return {
+            bool(is_reply): (count, datetime.fromisoformat(latest) if latest else None)
+            for is_reply, count, latest in rows
+        }
+
+    def timeline_texts(self, is_reply):
+        with self.lock:
+            rows = self.connection.execute("SELECT text FROM timeline WHERE is_reply = ? ORDER BY created_at", (int(is_reply),)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# ----------------------> SHARED LEDGER <---------------------- #
+reply_ledger = None
+reply_ledger_lock = threading.Lock()
+
+def get_reply_ledger():
+    # Opened on first use so importing the app (or its tests) never creates the ledger file
+    global reply_ledger
+    with reply_ledger_lock:
+        if reply_ledger is None:
+            reply_ledger = ReplyLedger(reply_ledger_path)
+        return reply_ledger
+
+def close_reply_ledger():
+    global reply_ledger
+    with reply_ledger_lock:
+        if reply_ledger is not None:
+            reply_ledger.close()
+            reply_ledger = None
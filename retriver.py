@@ -1,146 +1,377 @@
 import requests
 import os
-from twitter_apis import get_my_tweets_and_replies
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from twitter_apis import get_my_tweets_and_replies, get_my_tweet_texts
 import psycopg2
+from rag_db import rag_db_connection
 import re
+import time
+import threading
+from datetime import datetime, timezone
+from vector_index import local_search_batch, refresh_local_index
+from cache import VersionedCache, TTLCache, SingleFlight, MISSING
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# -----------------------> Pooled HTTP Client <----------------------- #
+http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+http_read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', 20))
+http_max_retries = int(os.getenv('HTTP_MAX_RETRIES', 3))
+http_backoff_factor = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))
+http_pool_size = int(os.getenv('HTTP_POOL_SIZE', 16))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def build_http_session(max_retries=http_max_retries):
+    # Keep-alive connections to mop.rekt.life are reused across calls; only idempotent methods are retried
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=http_backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+http_session = build_http_session()
+http_timeout = (http_connect_timeout, http_read_timeout)
+
+# -----------------------> RAG Retrieval Cache <----------------------- #
+# The RAG tables only change when the ETL runs, so cached lookups stay valid until last_update moves
+rag_cache = VersionedCache(maxsize=int(os.getenv('RAG_CACHE_SIZE', 1024)))
+rag_version_check_interval = float(os.getenv('RAG_VERSION_CHECK_INTERVAL', 60))
+# The version check is a freshness hint, not worth waiting on: one short attempt, no retries
+rag_version_timeout = (http_connect_timeout, float(os.getenv('RAG_VERSION_TIMEOUT', 2)))
+rag_version_session = build_http_session(max_retries=0)
+rag_version_state = {"version": None, "checked_at": None}
+rag_version_lock = threading.Lock()
+
+def normalize_query(query: str):
+    return " ".join(query.lower().split())
+
+def normalize_address(address: str):
+    # Solana mints are case-sensitive base58; only EVM hex addresses can be folded
+    address = address.strip()
+    return address.lower() if address.lower().startswith("0x") else address
+
+def rag_version_due():
+    checked_at = rag_version_state["checked_at"]
+    return checked_at is None or time.monotonic() - checked_at >= rag_version_check_interval
+
+def store_rag_version(update):
+    # A failed check keeps the previous version so a flaky update endpoint doesn't flush the cache
+    if "error" not in update:
+        rag_version_state["version"] = (update["coinmarketcap_update"], update["solana_tracker_update"])
+    rag_version_state["checked_at"] = time.monotonic()
+
+def refresh_rag_version():
+    # Scheduled in the background; at most one check runs at a time and nobody waits on it
+    if not rag_version_lock.acquire(blocking=False):
+        return
+    try:
+        store_rag_version(last_update_api(session=rag_version_session, timeout=rag_version_timeout))
+    finally:
+        rag_version_lock.release()
+
+def current_rag_version():
+    # Requests serve the last known version; if the background job has fallen behind, the first
+    # caller to notice does one short check and everyone else carries on with the old version
+    if rag_version_due():
+        refresh_rag_version()
+    return rag_version_state["version"]
+
+def invalidate_rag_cache():
+    rag_cache.clear()
+    rag_version_state["checked_at"] = None
+
+def cacheable_status(status_code: int):
+    # 4xx "not found" answers are cached as misses; throttling and server errors are not
+    return status_code < 500 and status_code != 429
+
 # -----------------------> Similarity/Distance BASE API <----------------------- #
-def distance_api(query: str):
-    BASE_URL = "https://mop.rekt.life/v1/query"
-    PARAMS = {"query": query}
-    
+DISTANCE_API_URL = "https://mop.rekt.life/v1/query"
+
+def distance_result(response):
+    if response.status_code == 200:
+        response = response.json()
+        top_items = sorted(response["data"], key=lambda x: x['distance'])[:3] 
+        return [item for item in top_items]
+    else:
+        return {"error": f"Error {response.status_code}: {response.text}"}
+
+local_vector_index_enabled = os.getenv('LOCAL_VECTOR_INDEX', 'false').lower() in ('1', 'true', 'yes')
+
+def local_distance_search(query: str):
+    # Top-3 from the in-process mirror of crypto_assets_embeddings, or None to fall back to the remote API
     try:
-        response = requests.get(BASE_URL, params=PARAMS)
+        results = local_search_batch([query], k=3)
+        return results[0] if results is not None else None
+    except Exception as e:
+        print(f"Local vector search failed, using remote API: {e}")
+        return None
+
+def distance_api(query: str):
+    if local_vector_index_enabled:
+        results = local_distance_search(query)
+        if results is not None:
+            return results
+
+    key = ("distance", normalize_query(query))
+    version = current_rag_version()
+    cached = rag_cache.get(key, version)
+    if cached is not MISSING:
+        return cached
 
+    try:
+        response = http_session.get(DISTANCE_API_URL, params={"query": query}, timeout=http_timeout)
+        result = distance_result(response)
         if response.status_code == 200:
-            response = response.json()
-            top_items = sorted(response["data"], key=lambda x: x['distance'])[:3] 
-            return [item for item in top_items]
-        else:
-            return {"error": f"Error {response.status_code}: {response.text}"}
+            rag_cache.set(key, result, version)
+        return result
     except requests.exceptions.RequestException as e:
         return {"error": f"Request failed: {e}"}
-    
+
 # -----------------------> Token API BASE API <----------------------- #
+TOKEN_API_URL = "http://mop.rekt.life/v1/search"
+
+def token_result(response):
+    if response.status_code == 200:
+        return response.json()
+    else:
+        # return {"error": f"Request failed with status code {response.status_code}", "details": response.text}
+        return {"data": f" "}
+
 def token_api(query: str):
-    url = "http://mop.rekt.life/v1/search"
+    key = ("token", normalize_address(query))
+    version = current_rag_version()
+    cached = rag_cache.get(key, version)
+    if cached is not MISSING:
+        return cached
+
     try:
-        response = requests.get(url, params={"query": query})
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            # return {"error": f"Request failed with status code {response.status_code}", "details": response.text}
-            return {"data": f" "}
-    
+        response = http_session.get(TOKEN_API_URL, params={"query": query}, timeout=http_timeout)
+        result = token_result(response)
+        if cacheable_status(response.status_code):
+            rag_cache.set(key, result, version)
+        return result
     except requests.exceptions.RequestException as e:
         return {"error": "Request exception occurred", "details": str(e)}
-    
+
 # -----------------------> Last Update API <----------------------- #
-def last_update_api():
-    url = "https://mop.rekt.life/v1/update/crypto_assets"
+UPDATE_API_URL = "https://mop.rekt.life/v1/update/crypto_assets"
+
+def last_update_result(data):
+    if isinstance(data, dict) and data.get("success") and isinstance(data.get("data"), list) and len(data["data"]) == 2:
+        coinmarketcap_update = data["data"][0].get("last_update", "N/A")
+        solana_tracker_update = data["data"][1].get("last_update", "N/A")
+        return {
+            "coinmarketcap_update": coinmarketcap_update,
+            "solana_tracker_update": solana_tracker_update
+        }
+    else:
+        return {"error": "Unexpected JSON structure or missing data."}
+
+def last_update_api(session=http_session, timeout=http_timeout):
     try:
-        response = requests.get(url)
+        response = session.get(UPDATE_API_URL, timeout=timeout)
         response.raise_for_status()
-
-        data = response.json()
-        if isinstance(data, dict) and data.get("success") and isinstance(data.get("data"), list) and len(data["data"]) == 2:
-            coinmarketcap_update = data["data"][0].get("last_update", "N/A")
-            solana_tracker_update = data["data"][1].get("last_update", "N/A")
-            return {
-                "coinmarketcap_update": coinmarketcap_update,
-                "solana_tracker_update": solana_tracker_update
-            }
-        else:
-            return {"error": "Unexpected JSON structure or missing data."}
+        return last_update_result(response.json())
     except requests.exceptions.RequestException as e:
         return {"error": "Request exception occurred", "details": str(e)}
     except ValueError:
         return {"error": "Failed to parse JSON response."}
-    
+
 # -------------------------> Update Data API <----------------------- #
+def update_result(response):
+    if response.status_code == 200: 
+        return response.json()
+    else:
+        return {"error": f"Request failed with status code {response.status_code}", "details": response.text}
+
 def update_api():
-    url = "https://mop.rekt.life/v1/update/crypto_assets"
     try:
-        response = requests.post(url)
-        
-        if response.status_code == 200: 
-            return response.json()
-        else:
-            return {"error": f"Request failed with status code {response.status_code}", "details": response.text}
-    
+        response = http_session.post(UPDATE_API_URL, timeout=http_timeout)
+        invalidate_rag_cache()
+        return update_result(response)
     except requests.exceptions.RequestException as e:
         return {"error": "Request exception occurred", "details": str(e)}
 
-# -----------------------> Tavily API for replies <----------------------- #
-from langchain_community.tools.tavily_search import TavilySearchResults
+# -----------------------> Shared Tavily Search <----------------------- #
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
 
 tavily_api_key = os.getenv('TAVILY_API_KEY')
 
-os.environ['TAVILY_API_KEY'] = tavily_api_key
+REPLY_NEWS_DOMAINS = ("https://crypto.news/", "https://cointelegraph.com/", "https://dexscreener.com/")
+POST_NEWS_DOMAINS = ("https://www.reuters.com/markets/cryptocurrency/", "https://www.forbes.com/digital-assets/news/?sh=487b1daf9d5b", "https://finance.yahoo.com/topic/crypto/", "https://crypto.news/", "https://finance.yahoo.com/markets/")
+
+search_cache = TTLCache(ttl=float(os.getenv('SEARCH_CACHE_TTL', 600)), maxsize=int(os.getenv('SEARCH_CACHE_SIZE', 512)))
+search_flights = SingleFlight()
+search_timeout = float(os.getenv('SEARCH_TIMEOUT', 15))
+# Shorter than SEARCH_TIMEOUT so a stuck Tavily request ends (and frees its thread) before the reply gives up on it
+search_request_timeout = (http_connect_timeout, float(os.getenv('SEARCH_REQUEST_TIMEOUT', 10)))
+
+def tavily_search(query: str, max_results: int, include_domains: tuple = ()):
+    # Same request and result shape as langchain's TavilySearchResults, which has no way to set a timeout
+    params = {
+        "api_key": tavily_api_key,
+        "query": query,
+        "max_results": max_results,
+        "search_depth": "advanced",
+        "include_domains": list(include_domains),
+        "include_answer": False,
+        "include_raw_content": False,
+        "include_images": False
+    }
+    try:
+        response = http_session.post(TAVILY_SEARCH_URL, json=params, timeout=search_request_timeout)
+        response.raise_for_status()
+        return [{"url": result["url"], "content": result["content"]} for result in response.json()["results"]]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        # Failures come back as a string, like the tool reported them
+        return repr(e)
+
+def cached_search(query: str, max_results: int, include_domains: tuple = ()):
+    # Replies hanging off the same post search near-identical terms: serve repeats from the TTL cache
+    # and merge identical searches that are already in flight into a single Tavily request
+    key = (max_results, include_domains, normalize_query(query))
+    cached = search_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    def run_search():
+        results = tavily_search(query, max_results, include_domains)
+        # Only real result lists are cached
+        if isinstance(results, list):
+            search_cache.set(key, results)
+        return results
+
+    return search_flights.do(key, run_search, timeout=search_timeout)
+
+# -----------------------> Tavily API for replies <----------------------- #
 def tavily_data(query: str):
-    tool = TavilySearchResults(max_results=5,include_domains=["https://crypto.news/", "https://cointelegraph.com/", "https://dexscreener.com/"], include_images=False, include_videos=False, include_links=True)
-    results = tool.invoke(query)
+    results = cached_search(query, 5, REPLY_NEWS_DOMAINS)
     # filtered_results = [{"title": item["title"], "content": item["content"]} for item in results]
     return results
 
 # -----------------------> Tavily google search <----------------------- #
 def google_search(query: str):
-    tool = TavilySearchResults(max_results=3, include_images=False, include_videos=False, include_links=True)
-    results = tool.invoke(query)
+    results = cached_search(query, 3)
     return results
 
 # -----------------------> Tavily for POSTs <----------------------- #
-tavily_api_key = os.getenv('TAVILY_API_KEY')
-
-os.environ['TAVILY_API_KEY'] = tavily_api_key
 def tavily_for_post(query: str):
-    tool = TavilySearchResults(max_results=1, include_domains=["https://www.reuters.com/markets/cryptocurrency/", "https://www.forbes.com/digital-assets/news/?sh=487b1daf9d5b", "https://finance.yahoo.com/topic/crypto/", "https://crypto.news/", "https://finance.yahoo.com/markets/"], include_images=False, include_videos=False, include_links=True)
-    # tools = [tool]
-    results = tool.invoke(query)
+    # Posts want the latest news every time, so this skips the cache
+    results = tavily_search(query, 1, POST_NEWS_DOMAINS)
     # filtered_results = [{"title": item["title"], "content": item["content"]} for item in results]
     return results
 
-# -----------------------> RAG DB STATS <----------------------- #
-def get_rag_db_stats():
-    db_params = {
-        'host': '147.93.40.59',
-        'port': 5432,
-        'dbname': 'postgres',
-        'user': 'postgres',
-        'password': 'vrHwHn0VNZq5h7z2nbe4bZworOaW5GEr'
+# -----------------------> Concurrent Retrieval <----------------------- #
+rag_timeout = float(os.getenv('RAG_TIMEOUT', 10))
+# RAG lookups and stats share one pool; web searches get their own, so slow searches can't starve either
+retrieval_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RETRIEVAL_WORKERS', 12)), thread_name_prefix="retrieval")
+search_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_WORKERS', 8)), thread_name_prefix="search")
+
+def rag_context(query: str, classification: dict):
+    if classification["category"] == "token":
+        token_address = classification.get("token_address", "")
+        return token_api(token_address)
+    return distance_api(query)
+
+def retrieve_context(query: str, tweet: str, classification: dict):
+    # Runs the independent sources concurrently; results come back in a fixed order (google, tavily, rag)
+    # and a source that misses its timeout contributes an empty result instead of holding up the reply
+    sources = {
+        "google": (search_executor, search_timeout, google_search, query + tweet),
+        "tavily": (search_executor, search_timeout, tavily_data, query),
+        "rag": (retrieval_executor, rag_timeout, rag_context, query, classification),
     }
 
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
+    started = time.monotonic()
+    futures = {
+        name: (timeout, executor.submit(fn, *args))
+        for name, (executor, timeout, fn, *args) in sources.items()
+    }
 
-        cursor.execute("""
-            SELECT SUM(reltuples)::BIGINT AS total_rows
-            FROM pg_class
-            WHERE relkind = 'r';
-        """)
-        total_rows = cursor.fetchone()[0]
+    results = {}
+    for name, (timeout, future) in futures.items():
+        remaining = max(0.0, started + timeout - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"Retrieval source '{name}' timed out after {timeout}s")
+            results[name] = []
 
-        cursor.execute("SELECT COUNT(*) FROM crypto_assets_embeddings;")
-        total_news_items = cursor.fetchone()[0]
+    return results
+
+# -----------------------> RAG DB STATS <----------------------- #
+STATS_TABLES = ("crypto_assets_embeddings", "trending_tokens")
+# crypto_assets_embeddings is the pgAI vectorizer view; its rows live (one per chunk) in the _store table,
+# and a view has no planner statistics of its own
+ESTIMATE_RELATIONS = {
+    "crypto_assets_embeddings": "crypto_assets_embeddings_store",
+    "trending_tokens": "trending_tokens"
+}
+# Exact counts scan the whole table, so they are computed at most once per TTL
+exact_count_cache = TTLCache(ttl=int(os.getenv('RAG_EXACT_COUNT_TTL', 600)), maxsize=1)
 
-        cursor.execute("SELECT COUNT(*) FROM trending_tokens;")
-        total_trending_tokens = cursor.fetchone()[0]
+def estimated_table_counts(cursor):
+    # Planner estimates kept current by autovacuum/ANALYZE; constant cost however large the tables get.
+    # Relations that aren't tables or have no statistics yet (-1 on PG14+, 0 before) come back as None.
+    relations = [ESTIMATE_RELATIONS[table] for table in STATS_TABLES]
+    cursor.execute("""
+        SELECT r, (
+            SELECT CASE WHEN relkind IN ('r', 'p', 'm') AND reltuples > 0 THEN reltuples::BIGINT END
+            FROM pg_class WHERE oid = to_regclass(r)
+        )
+        FROM unnest(%s::text[]) AS r;
+    """, (relations,))
+    estimates = dict(cursor.fetchall())
+    return {table: estimates.get(ESTIMATE_RELATIONS[table]) for table in STATS_TABLES}
 
-        last_news_update = cursor.fetchone()
-        last_news_update = last_news_update[0] if last_news_update else None
+def exact_table_counts():
+    cached = exact_count_cache.get("counts")
+    if cached is not MISSING:
+        return cached
+
+    with rag_db_connection() as conn, conn.cursor() as cursor:
+        counts = {}
+        for table in STATS_TABLES:
+            cursor.execute(f"SELECT COUNT(*) FROM {table};")
+            counts[table] = cursor.fetchone()[0]
+
+    exact_count_cache.set("counts", counts)
+    return counts
+
+def get_rag_db_stats(exact=False):
+    try:
+        with rag_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT SUM(GREATEST(reltuples, 0))::BIGINT AS total_rows
+                FROM pg_class
+                WHERE relkind = 'r';
+            """)
+            total_rows = cursor.fetchone()[0]
 
-        cursor.close()
-        conn.close()
+            # The default never scans; a relation without statistics yet reports None until ANALYZE runs
+            if not exact:
+                counts = estimated_table_counts(cursor)
+
+        if exact:
+            counts = exact_table_counts()
 
         stats = {
             'total_rows_in_rag_db': total_rows,
-            'total_news_items_processed': total_news_items,
-            'total_trending_tokens_processed': total_trending_tokens,
+            'total_news_items_processed': counts['crypto_assets_embeddings'],
+            'total_trending_tokens_processed': counts['trending_tokens'],
+            'rag_db_counts': 'exact' if exact else 'estimated'
         }
 
         return stats
@@ -149,18 +380,71 @@ def get_rag_db_stats():
         print(f"Database error: {e}")
         return None
 
+# -----------------------> Local Vector Index Refresh <----------------------- #
+def refresh_local_vector_index():
+    with rag_db_connection() as conn:
+        return refresh_local_index(conn)
+
 # -----------------------> Full STATS <----------------------- #
-def get_combined_stats_with_api():
-    twitter_data = get_my_tweets_and_replies()
-    db_data = get_rag_db_stats()
+# /stats serves this snapshot; a scheduled job refreshes it so requests never wait on X, Postgres or the ETL API
+stats_refresh_seconds = int(os.getenv('STATS_REFRESH_SECONDS', 300))
+stats_snapshot = {"sources": {}, "refreshed_at": None}
+stats_lock = threading.Lock()
+stats_flights = SingleFlight()
 
-    api_data = last_update_api()
+STATS_SOURCES = {
+    "twitter": get_my_tweets_and_replies,
+    "rag_db": get_rag_db_stats,
+    "api": last_update_api
+}
 
-    if twitter_data is None or db_data is None or "error" in api_data:
-        print("Error retrieving data from one or more sources.")
-        return None
+def fetch_stats_sources():
+    # The three sources are independent, so they are fetched side by side
+    futures = {name: retrieval_executor.submit(fn) for name, fn in STATS_SOURCES.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Stats source {name} failed: {e}")
+            result = None
+        if result is None or (isinstance(result, dict) and "error" in result):
+            print(f"Error retrieving {name} stats.")
+            result = None
+        results[name] = result
+    return results
+
+def refresh_stats_snapshot():
+    # A source that fails keeps its last good values instead of blanking the snapshot
+    def refresh():
+        results = fetch_stats_sources()
+        with stats_lock:
+            sources = dict(stats_snapshot["sources"])
+            sources.update({name: result for name, result in results.items() if result is not None})
+            stats_snapshot["sources"] = sources
+            stats_snapshot["refreshed_at"] = datetime.now(timezone.utc)
+    stats_flights.do("stats", refresh)
+
+def get_combined_stats_with_api(include_text=False, exact_counts=False):
+    # Never refreshes inline: sources that haven't succeeded yet are listed as unavailable and left to the scheduler
+    with stats_lock:
+        sources = dict(stats_snapshot["sources"])
+        refreshed_at = stats_snapshot["refreshed_at"]
+
+    if exact_counts:
+        # Served from exact_count_cache between refreshes; keeps the snapshot's estimates on error
+        sources["rag_db"] = get_rag_db_stats(exact=True) or sources.get("rag_db")
+        if sources["rag_db"] is None:
+            del sources["rag_db"]
+
+    combined_data = {}
+    for name in STATS_SOURCES:
+        combined_data.update(sources.get(name, {}))
+    combined_data["refreshed_at"] = refreshed_at
+    combined_data["unavailable_sources"] = [name for name in STATS_SOURCES if name not in sources]
 
-    combined_data = {**twitter_data, **db_data, **api_data}
+    if include_text:
+        combined_data.update(get_my_tweet_texts())
     return combined_data
 
 # --------------> Cleaner <------------------
@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import pytest
+from cache import SingleFlight
+
+
+def test_follower_stops_waiting_on_a_stuck_leader():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait()
+        return "late"
+
+    leader = threading.Thread(target=flights.do, args=("key", stuck))
+    leader.start()
+    started.wait()
+
+    with pytest.raises(FutureTimeoutError):
+        flights.do("key", lambda: "unused", timeout=0.05)
+    assert flights.merged == 1
+
+    release.set()
+    leader.join()
+    # Once the leader finishes the key is free again
+    assert flights.do("key", lambda: "fresh") == "fresh"
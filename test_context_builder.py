@@ -0,0 +1,38 @@
+from context_builder import item_text, source_snippets, assemble_context
+
+
+def test_token_record_keeps_market_fields_alongside_description():
+    record = {
+        "name": "Pepe",
+        "symbol": "PEPE",
+        "price": 0.0000123,
+        "market_cap": 5100000000,
+        "description": "The most memeable memecoin in existence.",
+        "id": 24478
+    }
+
+    text = item_text(record)
+
+    assert "price: 1.23e-05" in text
+    assert "market_cap: 5100000000" in text
+    assert "description: The most memeable memecoin" in text
+    assert "id:" not in text
+
+
+def test_search_hits_use_their_text_field():
+    tavily_hit = {"url": "https://example.com/a", "title": "Headline", "content": "Body of the article.", "score": 0.9}
+    rag_chunk = {"chunk": "ETF inflows hit a record.", "distance": 0.12, "embedding_uuid": "abc"}
+
+    assert item_text(tavily_hit) == "Body of the article."
+    assert item_text(rag_chunk) == "ETF inflows hit a record."
+
+
+def test_token_data_payload_reaches_the_context():
+    sources = {"rag": {"data": {"symbol": "PEPE", "price": 0.0000123, "description": "Frog coin."}}}
+
+    snippets = source_snippets("rag", sources["rag"])
+    text, report = assemble_context("pepe price", sources)
+
+    assert len(snippets) == 1
+    assert "price: 1.23e-05" in text
+    assert report["rag"] > 0
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import sys
+import types
+from unittest import mock
+import pytest
+
+pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+# These load models or reach the network at import; the xAI client is swapped for one on a mock transport
+HEAVY_MODULES = ("transformers", "torch", "retriver", "classifier")
+
+MODEL = "grok-3-mini-beta"
+
+
+def stub_module(name):
+    module = types.ModuleType(name)
+    module.__getattr__ = lambda attr: mock.MagicMock(name=f"{name}.{attr}")
+    return module
+
+
+def completion_body(content):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+def stream_body(pieces):
+    events = [
+        {
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": MODEL,
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+        }
+        for piece in pieces
+    ]
+    return "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+
+class StubXAI:
+    # Plays the xAI chat completions endpoint; records traffic and how many requests overlapped
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        self.requests.append(json.loads(request.content))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.statuses:
+                status = self.statuses.pop(0)
+                return httpx.Response(status, headers={"retry-after-ms": "10"}, json={"error": {"message": "slow down"}})
+            if self.requests[-1].get("stream"):
+                return httpx.Response(200, headers={"content-type": "text/event-stream"}, text=stream_body(["up ", "only"]))
+            return httpx.Response(200, json=completion_body("up only"))
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def inference(monkeypatch):
+    monkeypatch.setenv("XAI_API_KEY", "test")
+    for name in HEAVY_MODULES:
+        monkeypatch.setitem(sys.modules, name, stub_module(name))
+    monkeypatch.delitem(sys.modules, "inference", raising=False)
+
+    import inference
+    monkeypatch.setattr(inference, "retrieve_context", lambda query, tweet, classification: {"google": [], "tavily": [], "rag": []})
+    yield inference
+    sys.modules.pop("inference", None)
+
+
+def use_stub(inference, monkeypatch, stub, concurrency=4, max_retries=2):
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(
+        base_url="http://xai.test/v1",
+        api_key="test",
+        max_retries=max_retries,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(stub))
+    )
+    monkeypatch.setattr(inference, "xai_client", client)
+    monkeypatch.setattr(inference, "xai_semaphore", asyncio.Semaphore(concurrency))
+    return client
+
+
+@pytest.mark.anyio
+async def test_grok_inference_returns_completion(inference, monkeypatch):
+    stub = StubXAI()
+    use_stub(inference, monkeypatch, stub)
+
+    classification = {"category": "general"}
+    response, returned_classification, _ = await inference.grok_inference("where is $ETH going?", "", classification)
+
+    assert response == "up only"
+    assert returned_classification is classification
+    assert stub.requests[0]["model"] == MODEL
+    assert "where is $ETH going?" in stub.requests[0]["messages"][-1]["content"]
+
+
+@pytest.mark.anyio
+async def test_grok_stream_yields_deltas(inference, monkeypatch):
+    stub = StubXAI()
+    use_stub(inference, monkeypatch, stub)
+
+    pieces = [piece async for piece in inference.grok_stream([{"role": "user", "content": "gm"}])]
+
+    assert pieces == ["up ", "only"]
+    assert stub.requests[0]["stream"] is True
+
+
+@pytest.mark.anyio
+async def test_semaphore_caps_concurrent_xai_calls(inference, monkeypatch):
+    stub = StubXAI(delay=0.05)
+    use_stub(inference, monkeypatch, stub, concurrency=2)
+
+    calls = [inference.grok_inference(f"question {i}", "", {"category": "general"}) for i in range(6)]
+    results = await asyncio.gather(*calls)
+
+    assert [response for response, _, _ in results] == ["up only"] * 6
+    assert stub.max_in_flight == 2
+
+
+@pytest.mark.anyio
+async def test_rate_limited_call_is_retried(inference, monkeypatch):
+    stub = StubXAI(statuses=[429])
+    use_stub(inference, monkeypatch, stub)
+
+    response, _, _ = await inference.grok_inference("gm", "", {"category": "general"})
+
+    assert response == "up only"
+    assert len(stub.requests) == 2
@@ -0,0 +1,72 @@
+import asyncio
+import sys
+import time
+import types
+from unittest import mock
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("apscheduler")
+pytest.importorskip("pytz")
+pytest.importorskip("tweepy")
+httpx = pytest.importorskip("httpx")
+
+# These load models or reach X/Postgres at import; routes, executors and the event loop stay real
+HEAVY_MODULES = ("inference", "engine", "classifier", "retriver", "twitter_apis", "rag_db")
+
+BLOCKING_SECONDS = 2.0
+HEALTH_LIMIT_SECONDS = 0.1
+
+
+def stub_module(name):
+    module = types.ModuleType(name)
+    module.__getattr__ = lambda attr: mock.MagicMock(name=f"{name}.{attr}")
+    return module
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    for name in HEAVY_MODULES:
+        monkeypatch.setitem(sys.modules, name, stub_module(name))
+    monkeypatch.delitem(sys.modules, "generation", raising=False)
+
+    import generation
+    yield generation
+    sys.modules.pop("generation", None)
+
+
+@pytest.mark.anyio
+async def test_health_answers_while_reply_job_blocks(generation, monkeypatch):
+    def slow_timeline():
+        # Stands in for tweepy sleeping on a rate limit inside the reply job
+        time.sleep(BLOCKING_SECONDS)
+        return []
+
+    monkeypatch.setattr(generation, "get_latest_top3_posts", slow_timeline)
+
+    transport = httpx.ASGITransport(app=generation.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        started = time.perf_counter()
+        job = asyncio.create_task(client.post("/reply-to-recent"))
+        await asyncio.sleep(0.2)
+
+        latencies = []
+        while not job.done():
+            start = time.perf_counter()
+            response = await client.get("/health")
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+            await asyncio.sleep(0.05)
+
+        job_response = await job
+        job_seconds = time.perf_counter() - started
+
+    assert job_response.status_code == 200
+    assert job_seconds >= BLOCKING_SECONDS
+    assert len(latencies) >= 5
+    assert max(latencies) < HEALTH_LIMIT_SECONDS
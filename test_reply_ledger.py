@@ -0,0 +1,46 @@
+import threading
+import reply_ledger
+from reply_ledger import ReplyLedger, get_reply_ledger, close_reply_ledger
+
+
+def test_cursor_never_moves_backwards(tmp_path):
+    ledger = ReplyLedger(str(tmp_path / "ledger.sqlite3"))
+
+    ledger.set_cursor("mentions:1", 1900000000000000005)
+    ledger.set_cursor("mentions:1", 1900000000000000003)
+    assert ledger.get_cursor("mentions:1") == 1900000000000000005
+
+    ledger.set_cursor("mentions:1", 1900000000000000009)
+    assert ledger.get_cursor("mentions:1") == 1900000000000000009
+
+
+def test_overlapping_writers_keep_the_newest_cursor(tmp_path):
+    path = str(tmp_path / "ledger.sqlite3")
+    ledgers = [ReplyLedger(path) for _ in range(4)]
+    ids = list(range(1900000000000000000, 1900000000000000200))
+
+    def write(ledger, offset):
+        for since_id in ids[offset::4]:
+            ledger.set_cursor("conversation:1", since_id)
+
+    threads = [threading.Thread(target=write, args=(ledger, offset)) for offset, ledger in enumerate(ledgers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ReplyLedger(path).get_cursor("conversation:1") == max(ids)
+
+
+def test_shared_ledger_is_opened_on_first_use(tmp_path, monkeypatch):
+    path = tmp_path / "data" / "ledger.sqlite3"
+    monkeypatch.setattr(reply_ledger, "reply_ledger_path", str(path))
+    monkeypatch.setattr(reply_ledger, "reply_ledger", None)
+    assert not path.exists()
+
+    ledger = get_reply_ledger()
+    assert path.exists()
+    assert get_reply_ledger() is ledger
+
+    close_reply_ledger()
+    assert reply_ledger.reply_ledger is None
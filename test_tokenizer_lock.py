@@ -0,0 +1,62 @@
+import threading
+import time
+from tokenizer_lock import LockedTokenizer, locked_tokenizer
+
+
+class BorrowCheckingTokenizer:
+    # Mimics the Rust backend: a second caller while one is inside raises like "Already borrowed"
+    padding_side = "right"
+
+    def __init__(self):
+        self.busy = False
+
+    def enter(self):
+        if self.busy:
+            raise RuntimeError("Already borrowed")
+        self.busy = True
+        time.sleep(0.001)
+        self.busy = False
+
+    def __call__(self, text, padding=False):
+        self.enter()
+        return {"input_ids": [len(text)]}
+
+    def decode(self, ids):
+        self.enter()
+        return "x" * len(ids)
+
+    def __len__(self):
+        return 42
+
+
+def test_concurrent_calls_are_serialized():
+    tokenizer = LockedTokenizer(BorrowCheckingTokenizer())
+    errors = []
+
+    def hammer(padded):
+        try:
+            for _ in range(50):
+                tokenizer("hello", padding=padded)
+                tokenizer.decode([1, 2])
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(i % 2 == 0,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+def test_attributes_pass_through():
+    raw = BorrowCheckingTokenizer()
+    tokenizer = locked_tokenizer(raw)
+
+    tokenizer.padding_side = "left"
+
+    assert raw.padding_side == "left"
+    assert tokenizer.padding_side == "left"
+    assert len(tokenizer) == 42
+    assert locked_tokenizer(tokenizer) is tokenizer
@@ -0,0 +1,86 @@
+import json
+import numpy as np
+import vector_index
+from vector_index import LocalVectorIndex, snapshot_from_json, load_local_index
+
+
+def write_export(path, embeddings):
+    rows = [
+        {"id": i, "chunk": f"chunk {i}", "embedding": json.dumps(list(map(float, vector)))}
+        for i, vector in enumerate(embeddings)
+    ]
+    path.write_text(json.dumps(rows))
+    return path
+
+
+def test_snapshot_round_trip_and_search(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 768)).astype(np.float32)
+    export = write_export(tmp_path / "export.json", embeddings)
+
+    assert snapshot_from_json(str(export), str(tmp_path / "index")) == 50
+
+    index = LocalVectorIndex.load(str(tmp_path / "index"))
+    assert index.dimension == 768
+
+    # Each stored vector (scaled, to exercise normalization) should find itself first at distance ~0
+    queries = embeddings[[3, 17, 42]] * 5.0
+    results = index.search(queries, k=3)
+
+    assert [hits[0]["id"] for hits in results] == [3, 17, 42]
+    for hits in results:
+        assert len(hits) == 3
+        assert abs(hits[0]["distance"]) < 1e-5
+        assert [hit["distance"] for hit in hits] == sorted(hit["distance"] for hit in hits)
+        assert "embedding" not in hits[0]
+
+
+def test_search_caps_k_at_index_size(tmp_path):
+    embeddings = np.eye(4, dtype=np.float32)
+    snapshot_from_json(str(write_export(tmp_path / "export.json", embeddings)), str(tmp_path / "index"))
+
+    results = LocalVectorIndex.load(str(tmp_path / "index")).search(embeddings[0], k=10)
+
+    assert len(results) == 1
+    assert [hit["id"] for hit in results[0]][0] == 0
+    assert len(results[0]) == 4
+
+
+def test_dimension_mismatch_is_rejected_at_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "active_index", None)
+    embeddings = np.eye(8, dtype=np.float32)
+    snapshot_from_json(str(write_export(tmp_path / "export.json", embeddings)), str(tmp_path / "index"))
+
+    assert load_local_index(str(tmp_path / "index"), query_dimension=384) is None
+    assert vector_index.local_search_batch(["anything"]) is None
+
+    assert load_local_index(str(tmp_path / "index"), query_dimension=8) is not None
+
+
+class StubEmbedder:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.embeddings.shape[1]
+
+    def encode(self, texts, normalize_embeddings=False):
+        self.encoded.extend(texts)
+        return self.embeddings[[int(text.rsplit(" ", 1)[-1]) for text in texts]]
+
+
+def test_queries_go_through_the_embedding_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "active_index", None)
+    embeddings = np.eye(6, dtype=np.float32)
+    snapshot_from_json(str(write_export(tmp_path / "export.json", embeddings)), str(tmp_path / "index"))
+    embedder = StubEmbedder(embeddings)
+    monkeypatch.setattr(vector_index, "embedding_model", embedder)
+
+    # Dimension comes from the embedder when the caller doesn't pass one
+    assert load_local_index(str(tmp_path / "index")) is not None
+
+    results = vector_index.local_search_batch(["asset 2", "asset 5"], k=2)
+
+    assert embedder.encoded == ["search_query: asset 2", "search_query: asset 5"]
+    assert [hits[0]["id"] for hits in results] == [2, 5]
@@ -0,0 +1,36 @@
+import functools
+import threading
+
+# ----------------------> THREAD-SAFE TOKENIZER <---------------------- #
+class LockedTokenizer:
+    # HF fast tokenizers switch padding/truncation on the shared Rust backend inside every call, so two
+    # threads tokenizing at once (a padded batch next to an unpadded prompt) fail with "Already borrowed".
+    # Wrapping the tokenizer routes every method call, including decodes from streamers, through one lock.
+    def __init__(self, tokenizer):
+        object.__setattr__(self, "tokenizer", tokenizer)
+        object.__setattr__(self, "lock", threading.RLock())
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            return self.tokenizer(*args, **kwargs)
+
+    def __getattr__(self, name):
+        value = getattr(self.tokenizer, name)
+        if name.startswith("_") or not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def locked(*args, **kwargs):
+            with self.lock:
+                return value(*args, **kwargs)
+        return locked
+
+    def __setattr__(self, name, value):
+        with self.lock:
+            setattr(self.tokenizer, name, value)
+
+    def __len__(self):
+        return len(self.tokenizer)
+
+def locked_tokenizer(tokenizer):
+    return tokenizer if isinstance(tokenizer, LockedTokenizer) else LockedTokenizer(tokenizer)
@@ -8,6 +8,8 @@ from urllib.parse import urlparse, unquote
 from datetime import datetime, timedelta, timezone
 from urllib.parse import quote
 import logging
+from reply_ledger import get_reply_ledger
+from cache import TTLCache, MISSING
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -113,29 +115,42 @@ def get_latest_top3_posts():
         return {"error": f"Unexpected error: {str(e)}"}
     
 # ----------------> Extracting Tweet-Replies <----------------
+# Polled tweets older than this are dropped from the ledger; must cover filter_recent_replies' window
+poll_retention_hours = int(os.getenv("POLL_RETENTION_HOURS", 24))
+
 def get_replies_to_tweets(tweets_info):
+    # Each conversation is polled from its since_id cursor; earlier polls are read back from the ledger
     all_replies = []
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=poll_retention_hours)
+    get_reply_ledger().prune_polled(cutoff)
 
     for tweet in tweets_info:
         tweet_id = tweet['tweet_id']
         post_text = tweet['text']
+        source = f"conversation:{tweet_id}"
         query = f'conversation_id:{tweet_id} -is:retweet'
+        since_id = get_reply_ledger().get_cursor(source)
+        cursor_kwargs = {"since_id": since_id} if since_id else {}
 
         try:
+            new_replies = []
+            newest_id = None
             for response in tweepy.Paginator(
                 client.search_recent_tweets,
                 query=query,
                 tweet_fields=['author_id', 'created_at', 'in_reply_to_user_id'],
                 expansions='author_id',
                 user_fields=['username'],
-                max_results=100
+                max_results=100,
+                **cursor_kwargs
             ):
                 if response.data:
                     users = {u['id']: u for u in response.includes['users']}
                     for reply in response.data:
+                        newest_id = max(newest_id or 0, reply.id)
                         author = users.get(reply.author_id)
                         if author:
-                            all_replies.append({
+                            new_replies.append({
                                 'conversation_id': tweet_id,
                                 'parent_post_text': post_text,
                                 'tweet_id': reply.id,
@@ -143,9 +158,16 @@ def get_replies_to_tweets(tweets_info):
                                 'created_at': reply.created_at,
                                 'text': reply.text
                             })
+
+            # The cursor only moves once every page is stored, so a failed poll is simply retried next run
+            get_reply_ledger().store_polled(source, new_replies)
+            if newest_id:
+                get_reply_ledger().set_cursor(source, newest_id)
         except Exception as e:
             print(f"An error occurred while fetching replies for tweet {tweet_id}: {e}")
 
+        all_replies.extend(get_reply_ledger().polled_since(source, cutoff))
+
     return all_replies
 
 
@@ -223,19 +245,67 @@ def filter_recent_replies(replies, hours=3, max_replies=15):
     # Return only the latest X replies
     return recent_replies[:max_replies]
 
+# ----------------> Our Replies Lookup <------------------- #
+# Recent search rejects longer queries on the basic tier
+search_query_max_length = int(os.getenv("SEARCH_QUERY_MAX_LENGTH", 512))
+
+def conversation_queries(base_query, conversation_ids, max_length=search_query_max_length):
+    # ORs as many conversation_id clauses into each query as fit, so a run needs one or two searches
+    queries = []
+    clauses = []
+    for conversation_id in conversation_ids:
+        clause = f"conversation_id:{conversation_id}"
+        if clauses and len(f"{base_query} ({' OR '.join(clauses + [clause])})") > max_length:
+            queries.append(f"{base_query} ({' OR '.join(clauses)})")
+            clauses = []
+        clauses.append(clause)
+    if clauses:
+        queries.append(f"{base_query} ({' OR '.join(clauses)})")
+    return queries
+
+def get_replied_conversations(my_username, conversation_ids):
+    # Conversation ids (as strings) among the given ones where we have already posted a reply
+    replied = set()
+    conversation_ids = sorted({str(conversation_id) for conversation_id in conversation_ids})
+
+    for query in conversation_queries(f"from:{my_username} is:reply", conversation_ids):
+        for response in tweepy.Paginator(
+            client.search_recent_tweets,
+            query=query,
+            tweet_fields=['conversation_id'],
+            max_results=100
+        ):
+            for reply in response.data or []:
+                replied.add(str(reply.conversation_id))
+
+    return replied
+
 # ----------------> Filter unreplied tweets  <------------------- #
 def filter_unreplied_tweets(tweets, my_username=user_name):
     unreplied = []
     replied_conversations = set()
     replied_users_per_post = {}  # {parent_post_text: set of usernames}
 
-    # Ensure my_username is a string (handle) and not an ID
-    if isinstance(my_username, int):
+    # The ledger knows every reply we posted; X is only searched for conversations it has no record of
+    conversation_ids = [tweet.get('conversation_id', tweet['tweet_id']) for tweet in tweets]
+    already_replied = get_reply_ledger().replied_conversations(conversation_ids)
+    unknown_conversations = [conversation_id for conversation_id in conversation_ids if str(conversation_id) not in already_replied]
+
+    if unknown_conversations:
+        # Ensure my_username is a string (handle) and not an ID
+        if isinstance(my_username, int):
+            try:
+                user_response = client.get_user(id=my_username)
+                my_username = user_response.data.username
+            except Exception as e:
+                logger.error(f"Failed to get username for ID {my_username}: {e}")
+                return unreplied
+
+        # One lookup for every remaining conversation instead of a search per tweet
         try:
-            user_response = client.get_user(id=my_username)
-            my_username = user_response.data.username
+            already_replied |= get_replied_conversations(my_username, unknown_conversations)
         except Exception as e:
-            logger.error(f"Failed to get username for ID {my_username}: {e}")
+            logger.error(f"Failed to look up existing replies: {e}")
             return unreplied
 
     for tweet in tweets:
@@ -248,51 +318,23 @@ def filter_unreplied_tweets(tweets, my_username=user_name):
             continue
 
         # Skip if already replied in this conversation
-        if conversation_id in replied_conversations:
+        if conversation_id in replied_conversations or str(conversation_id) in already_replied:
             continue
 
         if parent_post_text not in replied_users_per_post:
-            replied_users_per_post[parent_post_text] = set()
+            replied_users_per_post[parent_post_text] = get_reply_ledger().replied_users(parent_post_text)
         if replying_user in replied_users_per_post[parent_post_text]:
             continue
 
-        query = f'conversation_id:{conversation_id} -is:retweet'
-
-        try:
-            found_reply = False
-            for response in tweepy.Paginator(
-                client.search_recent_tweets,
-                query=query,
-                tweet_fields=['author_id', 'created_at'],
-                expansions='author_id',
-                user_fields=['username'],
-                max_results=100
-            ):
-                if response.data:
-                    users = {u['id']: u for u in response.includes['users']}
-                    for reply in response.data:
-                        author = users.get(reply.author_id)
-                        if author and str(author.username).lower() == str(my_username).lower():
-                            found_reply = True
-                            break
-                if found_reply:
-                    break
-
-            if found_reply:
-                continue 
-            # Passed all filters — reply to this one
-            unreplied.append(tweet)
-            replied_conversations.add(conversation_id)
-            replied_users_per_post[parent_post_text].add(replying_user)
-
-        except Exception as e:
-            logger.error(f"Error checking tweet {tweet_id}: {e}")
-            continue
+        # Passed all filters — reply to this one
+        unreplied.append(tweet)
+        replied_conversations.add(conversation_id)
+        replied_users_per_post[parent_post_text].add(replying_user)
 
     return unreplied
 
 # ----------------> Reply to tweets <---------------
-def reply_to_tweet(tweet_id, reply_text):
+def reply_to_tweet(tweet_id, reply_text, conversation_id=None, username=None, parent_post_text=None):
     try:
         if not reply_text or not isinstance(reply_text, str):
             logger.error("Invalid reply text: must be a non-empty string")
@@ -300,6 +342,10 @@ def reply_to_tweet(tweet_id, reply_text):
         if len(reply_text) > 280:
             logger.error("Reply text exceeds 280 characters")
             return {"error": "Reply text exceeds 280 characters"}
+        # An overlapping run may already have answered this tweet
+        if get_reply_ledger().has_replied_to(tweet_id):
+            logger.info(f"Already replied to tweet {tweet_id}, skipping")
+            return {"error": "Already replied to this tweet"}
 
         logger.info(f"Posting reply to tweet {tweet_id}: {reply_text[:50]}...")
         response = client.create_tweet(
@@ -308,6 +354,10 @@ def reply_to_tweet(tweet_id, reply_text):
         )
 
         logger.info(f"Reply posted: https://twitter.com/user/status/{response.data['id']}")
+        try:
+            get_reply_ledger().record_reply(response.data["id"], tweet_id, conversation_id, username, parent_post_text)
+        except Exception as e:
+            logger.error(f"Failed to record reply to tweet {tweet_id} in the ledger: {e}")
         return {
             "success": True,
             "tweet_id": response.data["id"]
@@ -321,39 +371,92 @@ def reply_to_tweet(tweet_id, reply_text):
 
 from datetime import datetime, timezone
 
+# ----------------> Parent Tweets <----------------
+# Parent posts rarely change, so recently seen ones are reused across mention polls
+parent_tweet_cache = TTLCache(ttl=int(os.getenv("PARENT_TWEET_CACHE_TTL", 3600)), maxsize=1024)
+
+def resolve_parent_tweets(tweet_ids, included_tweets=()):
+    # {tweet_id: (author_id, text)} from the expansion payload, then the cache, then one batched lookup
+    parents = {}
+    for tweet in included_tweets:
+        parents[tweet.id] = (tweet.author_id, tweet.text)
+        parent_tweet_cache.set(tweet.id, parents[tweet.id])
+
+    missing = []
+    for tweet_id in dict.fromkeys(tweet_ids):
+        if tweet_id in parents:
+            continue
+        cached = parent_tweet_cache.get(tweet_id)
+        if cached is MISSING:
+            missing.append(tweet_id)
+        else:
+            parents[tweet_id] = cached
+
+    # get_tweets accepts up to 100 ids per call
+    for start in range(0, len(missing), 100):
+        response = client.get_tweets(ids=missing[start:start + 100], tweet_fields=['author_id', 'text'])
+        for tweet in response.data or []:
+            parents[tweet.id] = (tweet.author_id, tweet.text)
+            parent_tweet_cache.set(tweet.id, parents[tweet.id])
+
+    return parents
+
 # ----------------> Extract mentions <----------------
 def extract_mentions():
     try:
         username = "MIND_agent"
-        my_username_lower = username.lower()
 
         user = client.get_user(username=username)
         if not user.data:
             return []
 
         user_id = user.data.id
+        source = f"mentions:{user_id}"
+        since_id = get_reply_ledger().get_cursor(source)
 
-        mentions = client.get_users_mentions(
-            id=user_id,
-            max_results=10,
-            expansions=['author_id', 'referenced_tweets.id.author_id'],
-            tweet_fields=['created_at', 'referenced_tweets', 'conversation_id'],
-            user_fields=['username']
-        )
+        # The first poll takes the last 10 mentions; after that every page back to the cursor, so a
+        # burst of more than 100 mentions between runs isn't skipped when the cursor jumps ahead
+        if since_id:
+            cursor_kwargs = {"since_id": since_id, "max_results": 100}
+        else:
+            cursor_kwargs = {"max_results": 10, "limit": 1}
 
-        if not mentions.data:
-            return []
+        mention_tweets = []
+        included_users = []
+        included_tweets = []
+        for response in tweepy.Paginator(
+            client.get_users_mentions,
+            id=user_id,
+            expansions=['author_id', 'referenced_tweets.id', 'referenced_tweets.id.author_id'],
+            tweet_fields=['created_at', 'referenced_tweets', 'conversation_id', 'author_id'],
+            user_fields=['username'],
+            **cursor_kwargs
+        ):
+            if not response.data:
+                continue
+            mention_tweets.extend(response.data)
+            included_users.extend(response.includes.get('users', []))
+            included_tweets.extend(response.includes.get('tweets', []))
 
         # Get today's date in UTC
-        today_utc = datetime.now(timezone.utc).date()
-
-        author_ids = {user.id: user.username for user in mentions.includes.get('users', [])}
-
-        mention_details = []
-        replied_conversations = set()
-        replied_users_per_post = {}
-
-        for tweet in mentions.data:
+        now_utc = datetime.now(timezone.utc)
+        today_utc = now_utc.date()
+        start_of_today = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        author_ids = {user.id: user.username for user in included_users}
+
+        # Parents of today's replies and quotes, resolved in one pass instead of a get_tweet per mention
+        parent_ids = [
+            ref_tweet.id
+            for tweet in mention_tweets
+            if tweet.created_at.date() == today_utc
+            for ref_tweet in tweet.referenced_tweets or []
+            if ref_tweet.type in ['replied_to', 'quoted']
+        ]
+        parents = resolve_parent_tweets(parent_ids, included_tweets)
+
+        new_candidates = []
+        for tweet in mention_tweets:
             # 🔽 Filter only today's mentions
             if tweet.created_at.date() != today_utc:
                 continue
@@ -361,20 +464,12 @@ def extract_mentions():
             author_username = author_ids.get(tweet.author_id, 'Unknown')
             parent_author_id = None
             parent_post_text = None
-            conversation_id = tweet.conversation_id
-            tweet_id = tweet.id
 
             if tweet.referenced_tweets:
                 for ref_tweet in tweet.referenced_tweets:
                     if ref_tweet.type in ['replied_to', 'quoted']:
-                        ref_tweet_id = ref_tweet.id
-                        ref_tweet_data = client.get_tweet(
-                            id=ref_tweet_id,
-                            tweet_fields=['author_id', 'text']
-                        )
-                        if ref_tweet_data.data:
-                            parent_author_id = ref_tweet_data.data.author_id
-                            parent_post_text = ref_tweet_data.data.text
+                        if ref_tweet.id in parents:
+                            parent_author_id, parent_post_text = parents[ref_tweet.id]
                         else:
                             continue
             else:
@@ -384,49 +479,53 @@ def extract_mentions():
             if parent_author_id == user_id:
                 continue
 
-            if conversation_id in replied_conversations:
-                continue
-
-            if parent_post_text not in replied_users_per_post:
-                replied_users_per_post[parent_post_text] = set()
-            if author_username in replied_users_per_post[parent_post_text]:
-                continue
-
-            query = f'conversation_id:{conversation_id} -is:retweet'
-            try:
-                found_reply = False
-                for response in tweepy.Paginator(
-                    client.search_recent_tweets,
-                    query=query,
-                    tweet_fields=['author_id'],
-                    expansions='author_id',
-                    user_fields=['username'],
-                    max_results=10
-                ):
-                    if response.data:
-                        users = {u['id']: u for u in response.includes['users']}
-                        for reply in response.data:
-                            author = users.get(reply.author_id)
-                            if author and author.username.lower() == my_username_lower:
-                                found_reply = True
-                                break
-                    if found_reply:
-                        break
-                if found_reply:
-                    continue
-            except Exception as e:
-                logger.error(f"Error checking replies for tweet_id {tweet_id}: {e}")
-                continue
-
-            mention_details.append({
+            new_candidates.append({
                 'username': author_username,
                 'tweet_id': tweet.id,
                 'text': tweet.text,
                 'created_at': tweet.created_at,
                 'parent_post_text': parent_post_text,
-                'conversation_id': conversation_id
+                'conversation_id': tweet.conversation_id
             })
 
+        get_reply_ledger().store_polled(source, new_candidates)
+        if mention_tweets:
+            get_reply_ledger().set_cursor(source, max(tweet.id for tweet in mention_tweets))
+
+        # Today's mentions from earlier polls that were never answered are still candidates
+        get_reply_ledger().prune_polled(start_of_today - timedelta(hours=poll_retention_hours))
+        candidates = get_reply_ledger().polled_since(source, start_of_today)
+        if not candidates:
+            return []
+
+        # Ledger first; one X search covers whatever conversations it has no record of
+        conversation_ids = [mention['conversation_id'] for mention in candidates]
+        already_replied = get_reply_ledger().replied_conversations(conversation_ids)
+        unknown_conversations = [conversation_id for conversation_id in conversation_ids if str(conversation_id) not in already_replied]
+        try:
+            already_replied |= get_replied_conversations(username, unknown_conversations)
+        except Exception as e:
+            logger.error(f"Error checking existing replies to mentions: {e}")
+            return []
+
+        mention_details = []
+        replied_conversations = set()
+        replied_users_per_post = {}
+
+        for mention in candidates:
+            conversation_id = mention['conversation_id']
+            parent_post_text = mention['parent_post_text']
+            author_username = mention['username']
+
+            if conversation_id in replied_conversations or str(conversation_id) in already_replied:
+                continue
+
+            if parent_post_text not in replied_users_per_post:
+                replied_users_per_post[parent_post_text] = get_reply_ledger().replied_users(parent_post_text)
+            if author_username in replied_users_per_post[parent_post_text]:
+                continue
+
+            mention_details.append(mention)
             replied_conversations.add(conversation_id)
             replied_users_per_post[parent_post_text].add(author_username)
 
@@ -440,41 +539,56 @@ def extract_mentions():
         return []
 
 #  -----------------> STATS <---------------- #
-def get_my_tweets_and_replies():
-    user_response = client.get_me()
-    if user_response.data is None:
-        print("Authenticated user not found.")
-        return None
-    user_id = user_response.data.id
-
-    tweets = []
-    replies = []
-
+def get_my_tweets_and_replies(include_text=False):
+    # Only tweets newer than the timeline cursor are fetched; totals come from everything stored so far
+    user_id = user_name
+    if user_id is None:
+        user_response = client.get_me()
+        if user_response.data is None:
+            print("Authenticated user not found.")
+            return None
+        user_id = user_response.data.id
+
+    source = f"timeline:{user_id}"
+    since_id = get_reply_ledger().get_cursor(source)
+    cursor_kwargs = {"since_id": since_id} if since_id else {}
+
+    newest_id = None
     for response in tweepy.Paginator(
         client.get_users_tweets,
         id=user_id,
         tweet_fields=['created_at', 'in_reply_to_user_id'],
         max_results=100,
-        exclude=['retweets']
+        exclude=['retweets'],
+        **cursor_kwargs
     ):
         if response.data is None:
             continue
-        for tweet in response.data:
-            if tweet.in_reply_to_user_id is None:
-                tweets.append(tweet)
-            else:
-                replies.append(tweet)
+        get_reply_ledger().store_timeline(response.data)
+        newest_id = max([newest_id or 0] + [tweet.id for tweet in response.data])
+
+    if newest_id:
+        get_reply_ledger().set_cursor(source, newest_id)
 
-    last_tweet_timestamp = max((tweet.created_at for tweet in tweets), default=None)
-    last_reply_timestamp = max((reply.created_at for reply in replies), default=None)
+    counts = get_reply_ledger().timeline_counts()
+    total_tweets, last_tweet_timestamp = counts.get(False, (0, None))
+    total_replies, last_reply_timestamp = counts.get(True, (0, None))
 
     result = {
-        'total_tweets': len(tweets),
-        'total_replies': len(replies),
+        'total_tweets': total_tweets,
+        'total_replies': total_replies,
         'last_tweet_timestamp': last_tweet_timestamp,
-        'last_reply_timestamp': last_reply_timestamp,
-        'tweets': [tweet.text for tweet in tweets],
-        'replies': [reply.text for reply in replies]
+        'last_reply_timestamp': last_reply_timestamp
     }
 
-    return result
\ No newline at end of file
+    if include_text:
+        result.update(get_my_tweet_texts())
+
+    return result
+
+def get_my_tweet_texts():
+    # Local read from the stored timeline; never hits the API
+    return {
+        'tweets': get_reply_ledger().timeline_texts(is_reply=False),
+        'replies': get_reply_ledger().timeline_texts(is_reply=True)
+    }
@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import numpy as np
+
+local_index_dir = os.getenv('LOCAL_INDEX_DIR', 'Notebooks/data/vector_index')
+# Must be the same model the upstream pgAI vectorizer used to embed crypto_assets_embeddings (Ollama nomic-embed-text, 768-d)
+local_embedding_model_id = os.getenv('LOCAL_EMBEDDING_MODEL', 'nomic-ai/nomic-embed-text-v1.5')
+# nomic-embed-text expects a task prefix on every input; queries use search_query
+local_embedding_query_prefix = os.getenv('LOCAL_EMBEDDING_QUERY_PREFIX', 'search_query: ')
+
+EMBEDDINGS_FILE = "embeddings.npy"
+RECORDS_FILE = "records.json"
+EMBEDDING_COLUMN = "embedding"
+
+# ----------------------> SNAPSHOT <---------------------- #
+def parse_embedding(value):
+    # pgvector columns come back as "[0.1,0.2,...]" strings unless a vector adapter is registered
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+def write_snapshot(rows, index_dir=local_index_dir):
+    # Rows are dicts with an "embedding" field; the matrix is L2-normalized so search is a plain dot product
+    rows = [row for row in rows if row.get(EMBEDDING_COLUMN) is not None]
+    if not rows:
+        raise ValueError("No rows with embeddings to snapshot.")
+
+    matrix = np.stack([parse_embedding(row[EMBEDDING_COLUMN]) for row in rows])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1.0, norms)
+
+    records = [
+        {key: value for key, value in row.items() if key != EMBEDDING_COLUMN}
+        for row in rows
+    ]
+
+    # Write next to the live files and swap them in, so a reader never maps a half-written matrix
+    os.makedirs(index_dir, exist_ok=True)
+    embeddings_path = os.path.join(index_dir, EMBEDDINGS_FILE)
+    records_path = os.path.join(index_dir, RECORDS_FILE)
+    with open(embeddings_path + ".tmp", "wb") as f:
+        np.save(f, matrix.astype(np.float32))
+    with open(records_path + ".tmp", "w") as f:
+        json.dump(records, f, default=str)
+    os.replace(embeddings_path + ".tmp", embeddings_path)
+    os.replace(records_path + ".tmp", records_path)
+
+    return len(records)
+
+def snapshot_from_json(export_path, index_dir=local_index_dir):
+    with open(export_path) as f:
+        rows = json.load(f)
+    return write_snapshot(rows, index_dir)
+
+def snapshot_from_db(connection, index_dir=local_index_dir):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT * FROM crypto_assets_embeddings;")
+        columns = [column.name for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return write_snapshot(rows, index_dir)
+
+# ----------------------> LOCAL INDEX <---------------------- #
+class LocalVectorIndex:
+    # Memory-mapped embedding matrix with batched top-k cosine search
+    def __init__(self, embeddings, records):
+        if len(embeddings) != len(records):
+            raise ValueError(f"Index has {len(embeddings)} embeddings but {len(records)} records.")
+        self.embeddings = embeddings
+        self.records = records
+
+    @classmethod
+    def load(cls, index_dir=local_index_dir):
+        embeddings = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(index_dir, RECORDS_FILE)) as f:
+            records = json.load(f)
+        return cls(embeddings, records)
+
+    @property
+    def dimension(self):
+        return self.embeddings.shape[1]
+
+    def search(self, query_vectors, k=3):
+        # One matrix product for the whole batch; returns, per query, records with a cosine "distance"
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+
+        similarities = queries @ self.embeddings.T
+        k = min(k, similarities.shape[1])
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, candidates in zip(similarities, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([
+                {**self.records[index], "distance": float(1.0 - row[index])}
+                for index in ordered
+            ])
+        return results
+
+# ----------------------> QUERY EMBEDDING <---------------------- #
+embedding_model = None
+embedding_model_lock = threading.Lock()
+
+def get_embedding_model():
+    global embedding_model
+    with embedding_model_lock:
+        if embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            embedding_model = SentenceTransformer(local_embedding_model_id, device="cpu", trust_remote_code=True)
+    return embedding_model
+
+def embedding_dimension():
+    return get_embedding_model().get_sentence_embedding_dimension()
+
+def embed_queries(queries):
+    return get_embedding_model().encode(
+        [local_embedding_query_prefix + query for query in queries],
+        normalize_embeddings=True
+    )
+
+# ----------------------> ACTIVE INDEX <---------------------- #
+active_index = None
+
+def load_local_index(index_dir=local_index_dir, query_dimension=None):
+    # A snapshot whose width doesn't match the query embedder is never activated, so queries fall
+    # straight through to the remote API instead of failing one by one
+    global active_index
+    try:
+        index = LocalVectorIndex.load(index_dir)
+        query_dimension = embedding_dimension() if query_dimension is None else query_dimension
+        if query_dimension != index.dimension:
+            raise ValueError(f"{local_embedding_model_id} produces {query_dimension}-d vectors but the index is {index.dimension}-d.")
+        active_index = index
+        print(f"Loaded local vector index: {len(active_index.records)} rows")
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Local vector index unavailable: {e}")
+    return active_index
+
+def refresh_local_index(connection, index_dir=local_index_dir):
+    rows = snapshot_from_db(connection, index_dir)
+    print(f"Snapshotted {rows} rows of crypto_assets_embeddings")
+    return load_local_index(index_dir)
+
+def local_search_batch(queries, k=3):
+    # None when no index is loaded, so callers can fall back to the remote API
+    index = active_index
+    if index is None:
+        return None
+
+    return index.search(embed_queries(queries), k)